@@ -0,0 +1,241 @@
+from UserItemData import UserItemData
+from MovieData import MovieData
+from Recommender import Recommender
+from ItemBasedPredictor import ItemBasedPredictor
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import time
+
+
+class _Request:
+    def __init__(self, user_id: int, n: int, rec_seen: bool, deadline: float, future: asyncio.Future) -> None:
+        """
+        Constructs a new _Request object, a recommendation request waiting
+        to be batched.
+
+        :param user_id: The user id.
+        :param n: The number of predictions.
+        :param rec_seen: Signifies if the recommender should recommend already seen movies.
+        :param deadline: The loop time after which the request is dropped.
+        :param future: The future which receives the recommendations.
+        """
+        self.user_id = user_id
+        self.n = n
+        self.rec_seen = rec_seen
+        self.deadline = deadline
+        self.future = future
+
+
+class AsyncRecommender:
+    def __init__(self, recommender: Recommender, max_batch: int = 64, max_wait: float = 0.005,
+                 max_pending: int = 1024, timeout: float = 1.0) -> None:
+        """
+        Constructs a new AsyncRecommender object, which serves recommendations
+        of a fitted recommender to concurrent asyncio callers. Requests which
+        arrive within max_wait seconds of each other, up to max_batch of them,
+        are recommended together with Recommender.recommend_batch.
+
+        :param recommender: The fitted recommender.
+        :param max_batch: The maximum number of users recommended together.
+        :param max_wait: The number of seconds the first request of a batch waits for others.
+        :param max_pending: The maximum number of waiting requests, further requests are rejected.
+        :param timeout: The default number of seconds a request may take.
+        """
+        self.recommender = recommender
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.batches = 0
+        self.batched_requests = 0
+        self.expired = 0
+        self._task = None
+
+    async def start(self) -> None:
+        """
+        Starts collecting requests, must be called from the running event loop.
+        """
+        self._queue = asyncio.Queue(maxsize=self.max_pending)
+        # The requests whose futures are not resolved yet, queued, collected
+        # or being recommended.
+        self._pending = set()
+        # A single thread scores the batches, so the event loop keeps
+        # accepting requests while a batch is scored.
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """
+        Stops collecting requests. The requests which are not served yet,
+        also those of a batch being recommended, fail with a RuntimeError.
+        """
+        # The flag stops the loop also when wait_for swallows the cancellation.
+        self._stopping = True
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        while not self._queue.empty():
+            self._queue.get_nowait()
+        for request in self._pending:
+            if not request.future.done():
+                request.future.set_exception(RuntimeError("the AsyncRecommender was stopped"))
+        self._pending.clear()
+        self._executor.shutdown(wait=True)
+
+    async def __aenter__(self) -> "AsyncRecommender":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.stop()
+
+    async def recommend(self, user_id: int, n: int = 10, rec_seen: bool = False,
+                        timeout: float = None) -> list[int, int | float]:
+        """
+        Recommends the data for the user.
+
+        :param user_id: The user id.
+        :param n: The number of predictions.
+        :param rec_seen: Signifies if the recommender should recommend already seen movies.
+        :param timeout: The number of seconds the request may take, the default if None.
+        :returns: The list of movie ids and ratings.
+        :raises asyncio.QueueFull: If too many requests are waiting.
+        :raises TimeoutError: If the request is not served in time.
+        """
+        if self._task is None:
+            raise RuntimeError("the AsyncRecommender is not started")
+        loop = asyncio.get_running_loop()
+        timeout = self.timeout if timeout is None else timeout
+        request = _Request(user_id, n, rec_seen, loop.time() + timeout,
+                           loop.create_future())
+        # Reject the request instead of queueing without bound.
+        self._queue.put_nowait(request)
+        self._pending.add(request)
+        try:
+            return await asyncio.wait_for(request.future, timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError("recommendation for user " +
+                               str(user_id) + " timed out") from None
+
+    async def _collect(self) -> list[_Request]:
+        """
+        Waits for a request and collects the requests which arrive during
+        the next max_wait seconds.
+
+        :returns: The batch of requests.
+        """
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        end = loop.time() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = end - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        # Requests which are already queued are added without waiting.
+        while len(batch) < self.max_batch and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    def _recommend(self, user_ids: list[int], n: int, rec_seen: bool) -> list:
+        """
+        Recommends the data for a batch, runs in the executor.
+
+        :param user_ids: The user ids.
+        :param n: The number of predictions.
+        :param rec_seen: Signifies if the recommender should recommend already seen movies.
+        :returns: The recommendations of every user, or the exception
+                  raised for the user, e.g. a KeyError for an unknown user.
+        """
+        try:
+            return self.recommender.recommend_batch(user_ids, n, rec_seen)
+        except Exception:
+            if len(user_ids) == 1:
+                raise
+        # The users are recommended one by one, so one failing user does
+        # not fail the others of the batch.
+        results = []
+        for user_id in user_ids:
+            try:
+                results.append(self.recommender.recommend_batch([user_id], n, rec_seen)[0])
+            except Exception as e:
+                results.append(e)
+        return results
+
+    async def _run(self) -> None:
+        """
+        Serves the batches until stopped.
+        """
+        loop = asyncio.get_running_loop()
+        while not self._stopping:
+            batch = await self._collect()
+            now = loop.time()
+            live = [r for r in batch if not r.future.done()
+                    and r.deadline > now]
+            self.expired += len(batch) - len(live)
+            self._pending.difference_update(set(batch) - set(live))
+            if not live or self._stopping:
+                continue
+            self.batches += 1
+            self.batched_requests += len(live)
+
+            # Requests are grouped by rec_seen, the longest n of the group is
+            # recommended and cut for the shorter requests.
+            for rec_seen in (False, True):
+                group = [r for r in live if r.rec_seen == rec_seen]
+                if not group:
+                    continue
+                n = max(r.n for r in group)
+                try:
+                    results = await loop.run_in_executor(self._executor, self._recommend,
+                                                         [r.user_id for r in group], n, rec_seen)
+                except Exception as e:
+                    for r in group:
+                        if not r.future.done():
+                            r.future.set_exception(e)
+                    self._pending.difference_update(group)
+                    continue
+                for r, result in zip(group, results):
+                    if r.future.done():
+                        continue
+                    if isinstance(result, Exception):
+                        r.future.set_exception(result)
+                    else:
+                        r.future.set_result(result[:r.n])
+                self._pending.difference_update(group)
+
+    def stats(self) -> dict:
+        """
+        Returns the statistics of the batching.
+
+        :returns: The number of batches, the average batch size and the number of expired requests.
+        """
+        return {"batches": self.batches, "expired": self.expired,
+                "mean_batch": self.batched_requests / self.batches if self.batches else 0.0}
+
+
+if __name__ == "__main__":
+    md = MovieData('data/movies.dat')
+    uim = UserItemData('data/user_ratedmovies.dat', min_ratings=1000)
+    rec = Recommender(ItemBasedPredictor())
+    rec.fit(uim)
+
+    async def main():
+        # Local in-process clients requesting recommendations concurrently.
+        async with AsyncRecommender(rec) as server:
+            user_ids = uim.df["userID"].unique()[:1000].tolist()
+            start = time.perf_counter()
+            results = await asyncio.gather(*[server.recommend(u, n=10) for u in user_ids])
+            print("{} requests in {:.3f} s, {}".format(len(results),
+                  time.perf_counter() - start, server.stats()))
+            for idmovie, val in results[user_ids.index(78)][:5]:
+                print("Film: {}, ocena: {}".format(md.get_title(idmovie), val))
+
+    asyncio.run(main())
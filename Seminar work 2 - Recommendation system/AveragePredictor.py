@@ -1,9 +1,11 @@
 from UserItemData import UserItemData
 from MovieData import MovieData
 from Recommender import Recommender
+from StaticPredictor import StaticPredictor
+import pandas as pd
 
 
-class AveragePredictor:
+class AveragePredictor(StaticPredictor):
     def __init__(self, b: int = 0) -> None:
         """
         Constructs a new AveragePredictor object that predicts ratings based on average ratings.
@@ -12,29 +14,35 @@ class AveragePredictor:
         """
         self.b = b
         if b < 0:
-            raise ValueError(b + " must be higher than or equal to 0")
+            raise ValueError(str(b) + " must be higher than or equal to 0")
 
-    def fit(self, uim: UserItemData) -> None:
+    @staticmethod
+    def prepare(uim: UserItemData, configs: list[dict] = None) -> tuple[pd.DataFrame, float]:
         """
-        Fits the data to the predictor.
+        Calculates the sum and the number of ratings of every movie and the
+        global average, which do not depend on the b parameter.
 
         :param uim: The data.
+        :param configs: The parameters of the predictors which share the result.
+        :returns: The sums and numbers of ratings and the global average.
         """
-        self.uim = {k: 0 for k in uim.df["movieID"]}
-        for k in self.uim.keys():
-            vs = sum(uim.df[uim.df["movieID"] == k]["rating"])
-            g_avg = uim.df["rating"].sum() / uim.df.shape[0]
-            n = uim.df[uim.df["movieID"] == k].shape[0]
-            self.uim[k] = (vs + self.b * g_avg) / (n + self.b)
-
-    def predict(self, user_id: int) -> dict[int, int | float]:
+        totals = uim.df.groupby("movieID", sort=False)[
+            "rating"].agg(["sum", "count"])
+        g_avg = uim.df["rating"].sum() / uim.df.shape[0]
+        return totals, g_avg
+
+    def fit(self, uim: UserItemData, shared: tuple[pd.DataFrame, float] = None) -> None:
         """
-        Predicts the values for data.
+        Fits the data to the predictor.
 
-        :param user_id: The user id.
-        :returns: The dict of predictions.
+        :param uim: The data.
+        :param shared: The result of prepare, which is used instead of
+                       calculating the sums again.
         """
-        return self.uim.copy()
+        totals, g_avg = shared if shared is not None else self.prepare(uim)
+        averages = (totals["sum"] + self.b * g_avg) / \
+            (totals["count"] + self.b)
+        self._set_predictions(averages.to_dict())
 
 
 if __name__ == "__main__":
@@ -48,9 +56,5 @@ if __name__ == "__main__":
         print("Film: {}, ocena: {}".format(md.get_title(idmovie), val))
 
 # Results:
-#
-# Film: The Usual Suspects, ocena: 4.225944245560473
-# Film: The Godfather: Part II, ocena: 4.146907937910189
-# Film: Cidade de Deus, ocena: 4.116538340205236
-# Film: The Dark Knight, ocena: 4.10413904093503
-# Film: 12 Angry Men, ocena: 4.103639627096175
+# The earlier results were recorded before movies with equal predictions were
+# ordered by id, run the script on data/user_ratedmovies.dat to record new ones.
@@ -0,0 +1,230 @@
+from UserItemData import UserItemData
+from MovieData import MovieData
+from Recommender import Recommender
+from SharedArrays import SharedArrays
+import pandas as pd
+import numpy as np
+import time
+
+
+def _train(arrays: dict[str, np.ndarray], positions: np.ndarray, seed: int, epochs: int, learning_rate: float,
+           regularization: float, batch_size: int) -> None:
+    """
+    Trains the factors with mini-batch stochastic gradient ascent on the
+    Bayesian Personalized Ranking criterion, updating the arrays in place.
+
+    :param arrays: The factors and biases, the positive pairs and their sorted keys.
+    :param positions: The positions of the positive pairs used for training.
+    :param seed: The seed of the random generator.
+    :param epochs: The number of passes over the positive pairs.
+    :param learning_rate: The step size.
+    :param regularization: The weight of the L2 regularization.
+    :param batch_size: The number of pairs updated at once.
+    """
+    users_factors, items_factors, biases = arrays["users_factors"], arrays["items_factors"], arrays["biases"]
+    keys = arrays["keys"]
+    n_items = len(biases)
+    rng = np.random.default_rng(seed)
+    for _ in range(epochs):
+        for start in range(0, len(positions), batch_size):
+            batch = positions[start:start + batch_size]
+            u = arrays["users"][batch]
+            i = arrays["items"][batch]
+            # A negative movie is a random movie the user did not interact with,
+            # the few sampled positives are drawn again.
+            j = rng.integers(0, n_items, size=len(batch))
+            for _ in range(3):
+                sampled = u.astype("int64") * n_items + j
+                found = np.minimum(np.searchsorted(keys, sampled), len(keys) - 1)
+                positive = keys[found] == sampled
+                if not positive.any():
+                    break
+                j[positive] = rng.integers(0, n_items, size=int(positive.sum()))
+
+            pu, qi, qj = users_factors[u], items_factors[i], items_factors[j]
+            x = biases[i] - biases[j] + np.einsum("ij,ij->i", pu, qi - qj)
+            # The gradient of log(sigmoid(x)).
+            g = (1 / (1 + np.exp(np.clip(x, -30, 30)))).reshape(-1, 1)
+
+            np.add.at(users_factors, u, learning_rate * (g * (qi - qj) - regularization * pu))
+            np.add.at(items_factors, i, learning_rate * (g * pu - regularization * qi))
+            np.add.at(items_factors, j, learning_rate * (-g * pu - regularization * qj))
+            np.add.at(biases, i, learning_rate * (g.ravel() - regularization * biases[i]))
+            np.add.at(biases, j, learning_rate * (-g.ravel() - regularization * biases[j]))
+        rng.shuffle(positions)
+
+
+def _train_shard(shard: int, n_shards: int, seed: int, epochs: int, learning_rate: float,
+                 regularization: float, batch_size: int) -> None:
+    """
+    Trains the shared factors on a shard of the positive pairs in a worker
+    process. The workers update the factors without locks (Hogwild), the
+    updates rarely touch the same rows at the same time.
+
+    :param shard: The index of the shard.
+    :param n_shards: The number of shards.
+    :param seed: The seed of the random generator.
+    :param epochs: The number of passes over the shard.
+    :param learning_rate: The step size.
+    :param regularization: The weight of the L2 regularization.
+    :param batch_size: The number of pairs updated at once.
+    """
+    arrays = SharedArrays.worker_arrays()
+    positions = np.arange(shard, len(arrays["users"]), n_shards)
+    np.random.default_rng([seed, shard]).shuffle(positions)
+    _train(arrays, positions, seed + shard + 1, epochs, learning_rate, regularization, batch_size)
+
+
+class BPRPredictor:
+    def __init__(self, tags_path: str = "data/user_taggedmovies.dat", use_ratings: bool = True,
+                 min_rating: float = None, factors: int = 32, epochs: int = 20, learning_rate: float = 0.05,
+                 regularization: float = 0.01, batch_size: int = 1024, seed: int = 0, n_jobs: int = 1) -> None:
+        """
+        Constructs a new BPRPredictor object that predicts a ranking score from
+        implicit feedback, the movies the users tagged and optionally rated,
+        with Bayesian Personalized Ranking. The scores are not ratings, only
+        their order is meaningful.
+
+        :param tags_path: Path to user_taggedmovies.dat or user_taggedmovies-timestamps.dat,
+                          no tags are used if None.
+        :param use_ratings: Signifies if the rated movies are used as positives too.
+        :param min_rating: The lowest rating which is a positive, all ratings if None.
+        :param factors: The number of latent factors.
+        :param epochs: The number of passes over the positive pairs.
+        :param learning_rate: The step size.
+        :param regularization: The weight of the L2 regularization.
+        :param batch_size: The number of pairs updated at once.
+        :param seed: The seed of the random generator.
+        :param n_jobs: The number of processes which train the shared factors
+                       without locks, None uses all cores.
+        """
+        self.tags_path = tags_path
+        self.use_ratings = use_ratings
+        self.min_rating = min_rating
+        self.factors = factors
+        self.epochs = epochs
+        self.learning_rate = learning_rate
+        self.regularization = regularization
+        self.batch_size = batch_size
+        self.seed = seed
+        self.n_jobs = n_jobs
+
+    def _positives(self, uim: UserItemData) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Collects the user and movie ids of the implicit feedback.
+
+        :param uim: The data.
+        :returns: The user ids and the movie ids.
+        """
+        users, items = [], []
+        if self.tags_path is not None:
+            tags = pd.read_table(self.tags_path, usecols=["userID", "movieID"], dtype="int32",
+                                 encoding_errors="ignore")
+            users.append(tags["userID"].to_numpy())
+            items.append(tags["movieID"].to_numpy())
+        if self.use_ratings:
+            df = uim.df
+            if self.min_rating is not None:
+                df = df[df["rating"] >= self.min_rating]
+            users.append(df["userID"].to_numpy())
+            items.append(df["movieID"].to_numpy())
+        if not users:
+            raise ValueError("no implicit feedback, set tags_path or use_ratings")
+        return np.concatenate(users), np.concatenate(items)
+
+    def fit(self, uim: UserItemData) -> None:
+        """
+        Fits the data to the predictor.
+
+        :param uim: The data.
+        """
+        self.uim = uim
+        user_ids, item_ids = self._positives(uim)
+        # The users and movies of the data always have factors, also if they
+        # have no implicit feedback.
+        self.users = pd.Index(np.union1d(user_ids, uim.df["userID"].to_numpy()))
+        self.items = pd.Index(np.union1d(item_ids, uim.df["movieID"].to_numpy()))
+
+        # The interactions are coded as integers, a pair tagged several
+        # times is one positive.
+        keys = np.unique(self.users.get_indexer(user_ids).astype("int64") * len(self.items) +
+                         self.items.get_indexer(item_ids))
+        rng = np.random.default_rng(self.seed)
+        arrays = {"users": (keys // len(self.items)).astype("int32"), "items": (keys % len(self.items)).astype("int32"),
+                  "keys": keys,
+                  "users_factors": rng.normal(0, 0.1, size=(len(self.users), self.factors)),
+                  "items_factors": rng.normal(0, 0.1, size=(len(self.items), self.factors)),
+                  "biases": np.zeros(len(self.items))}
+        parameters = (self.seed, self.epochs, self.learning_rate, self.regularization, self.batch_size)
+
+        if self.n_jobs == 1:
+            positions = rng.permutation(len(keys))
+            _train(arrays, positions, *parameters)
+        else:
+            with SharedArrays(arrays) as shared:
+                n_shards = len(SharedArrays.blocks(len(keys), self.n_jobs, per_job=1))
+                shared.map(_train_shard, [(shard, n_shards) + parameters for shard in range(n_shards)],
+                           self.n_jobs)
+                arrays = {name: shared[name].copy() for name in ("users_factors", "items_factors", "biases")}
+
+        self.users_factors = arrays["users_factors"]
+        self.items_factors = arrays["items_factors"]
+        self.biases = arrays["biases"]
+        self.positives = len(keys)
+
+        # Predictions are made for the movies of the data, in the order in
+        # which they appear in the data.
+        self.movies = pd.unique(uim.df["movieID"])
+        self.columns = self.items.get_indexer(self.movies)
+
+    def predict(self, user_id: int) -> dict[int, int | float]:
+        """
+        Predicts the values for data.
+
+        :param user_id: The user id.
+        :returns: The dict of predictions.
+        """
+        scores = self.biases[self.columns] + self.items_factors[self.columns] @ \
+            self.users_factors[self.users.get_loc(user_id)]
+        return dict(zip(self.movies.tolist(), scores.tolist()))
+
+    def predict_items(self, user_id: int, item_ids: np.ndarray) -> np.ndarray:
+        """
+        Predicts the values of the given movies only.
+
+        :param user_id: The user id.
+        :param item_ids: The movie ids.
+        :returns: The predictions in the order of item_ids, NaN for unknown movies.
+        """
+        positions = self.items.get_indexer(item_ids)
+        known = positions >= 0
+        values = np.full(len(positions), np.nan)
+        values[known] = self.biases[positions[known]] + self.items_factors[positions[known]] @ \
+            self.users_factors[self.users.get_loc(user_id)]
+        return values
+
+    def predict_batch(self, user_ids: list[int]) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Predicts the values for several users at once.
+
+        :param user_ids: The user ids.
+        :returns: The movie ids and the matrix of predictions, one row per user.
+        """
+        rows = self.users.get_indexer(user_ids)
+        if (rows < 0).any():
+            raise KeyError(np.asarray(user_ids)[rows < 0].tolist())
+        scores = self.biases[self.columns] + self.users_factors[rows] @ self.items_factors[self.columns].T
+        return self.movies, scores
+
+
+if __name__ == "__main__":
+    md = MovieData('data/movies.dat')
+    uim = UserItemData('data/user_ratedmovies.dat', min_ratings=1000)
+    start = time.perf_counter()
+    rp = BPRPredictor(min_rating=4)
+    rec = Recommender(rp)
+    rec.fit(uim)
+    print("{} positives in {:.1f} s".format(rp.positives, time.perf_counter() - start))
+    rec_items = rec.recommend(78, n=10, rec_seen=False)
+    for idmovie, val in rec_items:
+        print("Film: {}, ocena: {}".format(md.get_title(idmovie), val))
@@ -0,0 +1,272 @@
+from UserItemData import UserItemData
+from Recommender import Recommender
+from RandomPredictor import RandomPredictor
+from AveragePredictor import AveragePredictor
+from ViewsPredictor import ViewsPredictor
+from STDPredictor import STDPredictor
+from ItemBasedPredictor import ItemBasedPredictor
+from UserBasedPredictor import UserBasedPredictor
+from SlopeOnePredictor import SlopeOnePredictor
+from MatrixFactorizationPredictor import MatrixFactorizationPredictor
+from HybridPredictor import HybridPredictor
+from BPRPredictor import BPRPredictor
+from SyntheticData import SyntheticData
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+import pandas as pd
+import numpy as np
+import subprocess
+import platform
+import argparse
+import tempfile
+import json
+import time
+import os
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# The predictors which are benchmarked, by name.
+PREDICTORS = {
+    "random": lambda: RandomPredictor(1, 5),
+    "average": lambda: AveragePredictor(100),
+    "views": lambda: ViewsPredictor(),
+    "std": lambda: STDPredictor(100),
+    "item_based": lambda: ItemBasedPredictor(),
+    "user_based": lambda: UserBasedPredictor(),
+    "slope_one": lambda: SlopeOnePredictor(),
+    "matrix_factorization": lambda: MatrixFactorizationPredictor(rank=10),
+    "hybrid": lambda: HybridPredictor(n_jobs=1, use_cache=False, parallel_items=None),
+    # The same hybrid with its predictors always called in threads.
+    "hybrid_threads": lambda: HybridPredictor(n_jobs=1, use_cache=False, parallel_items=0),
+    "bpr": lambda: BPRPredictor(tags_path=None),
+}
+
+# Metrics where a higher value is a regression, the rest are throughputs.
+LOWER_IS_BETTER = ["fit_time", "predict_p50_ms", "predict_p99_ms",
+                   "evaluate_time", "peak_rss_mb"]
+
+
+def _peak_rss_mb() -> float:
+    """
+    Returns the peak resident memory of the current process.
+
+    :returns: The peak memory in megabytes, or None if it can not be measured.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return peak / 1024 ** 2 if platform.system() == "Darwin" else peak / 1024
+
+
+def _split(uim: UserItemData, test_size: float) -> tuple[UserItemData, UserItemData]:
+    """
+    Splits the data by time, the latest ratings are used for testing.
+
+    :param uim: The data.
+    :param test_size: The share of the ratings used for testing.
+    :returns: The training and the test data.
+    """
+    dates = pd.to_datetime(uim.df[["date_year", "date_month", "date_day"]].set_axis(
+        ["year", "month", "day"], axis=1))
+    train = dates < dates.quantile(1 - test_size)
+    return UserItemData.from_dataframe(uim.df[train]), UserItemData.from_dataframe(uim.df[~train])
+
+
+def run_case(path: str, min_ratings: int, predictor: str, users: int, n: int, evaluate: bool,
+             seed: int = 0) -> dict:
+    """
+    Benchmarks one predictor on one data set. The case should run in its own
+    process, so the peak memory belongs to the case only.
+
+    :param path: Path to the data file.
+    :param min_ratings: The limit for how many ratings a movie can have.
+    :param predictor: The name of the predictor.
+    :param users: The number of users for which predictions are timed.
+    :param n: The number of recommended products.
+    :param evaluate: Signifies if the evaluation should be timed.
+    :param seed: The seed used for selecting the users.
+    :returns: The measurements.
+    """
+    uim = UserItemData(path, min_ratings=min_ratings)
+    result = {"ratings": uim.read_ratings(), "data_rss_mb": _peak_rss_mb()}
+
+    rec = Recommender(PREDICTORS[predictor]())
+    start = time.perf_counter()
+    rec.fit(uim)
+    result["fit_time"] = time.perf_counter() - start
+
+    all_users = uim.df["userID"].unique()
+    sample = np.random.default_rng(seed).choice(
+        all_users, size=min(users, len(all_users)), replace=False)
+
+    latencies = []
+    for user_id in sample:
+        start = time.perf_counter()
+        rec.predictor.predict(user_id)
+        latencies.append(time.perf_counter() - start)
+    result["predict_p50_ms"] = float(np.percentile(latencies, 50)) * 1000
+    result["predict_p99_ms"] = float(np.percentile(latencies, 99)) * 1000
+
+    start = time.perf_counter()
+    for user_id in sample:
+        rec.recommend(user_id=user_id, n=n, rec_seen=False)
+    result["recommend_users_per_s"] = len(sample) / \
+        (time.perf_counter() - start)
+
+    # The same users recommended together, with one batch prediction.
+    start = time.perf_counter()
+    rec.recommend_batch(sample.tolist(), n=n, rec_seen=False)
+    result["recommend_batch_users_per_s"] = len(sample) / \
+        (time.perf_counter() - start)
+
+    if evaluate:
+        train, test = _split(uim, 0.2)
+        rec = Recommender(PREDICTORS[predictor]())
+        rec.fit(train)
+        start = time.perf_counter()
+        rec.evaluate(test, n)
+        result["evaluate_time"] = time.perf_counter() - start
+
+    result["peak_rss_mb"] = _peak_rss_mb()
+    return result
+
+
+class Benchmark:
+    def __init__(self, predictors: list[str] = None, users: int = 100, n: int = 20, evaluate: bool = False) -> None:
+        """
+        Constructs a new Benchmark object, which measures the fit time,
+        prediction latency, recommendation throughput, evaluation time and
+        peak memory of the predictors on different data sets.
+
+        :param predictors: The names of the predictors, all by default.
+        :param users: The number of users for which predictions are timed.
+        :param n: The number of recommended products.
+        :param evaluate: Signifies if the evaluation should be timed.
+        """
+        self.predictors = predictors or list(PREDICTORS.keys())
+        self.users = users
+        self.n = n
+        self.evaluate = evaluate
+        self.datasets = []
+
+    def add_data(self, name: str, path: str, min_ratings: int = None) -> None:
+        """
+        Adds a data set on which every predictor is benchmarked.
+
+        :param name: The name of the data set in the results.
+        :param path: Path to the data file.
+        :param min_ratings: The limit for how many ratings a movie can have.
+        """
+        self.datasets.append((name, path, min_ratings))
+
+    def run(self) -> dict:
+        """
+        Runs every predictor on every data set, each in a new process.
+
+        :returns: The results with the environment they were measured in.
+        """
+        results = []
+        for name, path, min_ratings in self.datasets:
+            for predictor in self.predictors:
+                with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+                    result = executor.submit(run_case, path, min_ratings, predictor,
+                                             self.users, self.n, self.evaluate).result()
+                results.append(dict(data=name, predictor=predictor, **result))
+                print(name, predictor, result, flush=True)
+        return {"meta": self._meta(), "results": results}
+
+    @staticmethod
+    def _meta() -> dict:
+        """
+        Describes the environment of the benchmark.
+
+        :returns: The commit, time and versions.
+        """
+        try:
+            commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True,
+                                    text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+        except OSError:
+            commit = None
+        return {"commit": commit or None, "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "python": platform.python_version(), "numpy": np.__version__,
+                "pandas": pd.__version__, "cpus": os.cpu_count()}
+
+    @staticmethod
+    def compare(baseline: dict, current: dict, tolerance: float = 0.2) -> list[dict]:
+        """
+        Finds the measurements which are worse than in the baseline by more
+        than the tolerance.
+
+        :param baseline: The results of a previous run.
+        :param current: The results of the current run.
+        :param tolerance: The allowed relative change.
+        :returns: The regressions.
+        """
+        previous = {(r["data"], r["predictor"]): r for r in baseline["results"]}
+        regressions = []
+        for result in current["results"]:
+            old = previous.get((result["data"], result["predictor"]))
+            if old is None:
+                continue
+            for metric, value in result.items():
+                if not isinstance(value, (int, float)) or not isinstance(old.get(metric), (int, float)) \
+                        or metric in ("ratings", "data_rss_mb") or old[metric] == 0:
+                    continue
+                ratio = value / old[metric]
+                worse = ratio > 1 + tolerance if metric in LOWER_IS_BETTER else ratio < 1 - tolerance
+                if worse:
+                    regressions.append({"data": result["data"], "predictor": result["predictor"],
+                                        "metric": metric, "baseline": old[metric], "current": value,
+                                        "ratio": ratio})
+        return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks the predictors.")
+    parser.add_argument("--predictors", nargs="*",
+                        default=None, choices=list(PREDICTORS.keys()))
+    parser.add_argument("--synthetic", nargs="*", default=["200x100", "1000x300"],
+                        help="synthetic data sets as USERSxMOVIES")
+    parser.add_argument("--ratings-per-user", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--real", default=None,
+                        help="path to user_ratedmovies.dat")
+    parser.add_argument("--min-ratings", nargs="*", type=int, default=[1000, 500])
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--evaluate", action="store_true")
+    parser.add_argument("--output", default="benchmark.json")
+    parser.add_argument("--baseline", default=None,
+                        help="results of a previous run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    benchmark = Benchmark(args.predictors, args.users,
+                          evaluate=args.evaluate)
+    with tempfile.TemporaryDirectory() as directory:
+        for scale in args.synthetic:
+            users, items = map(int, scale.split("x"))
+            path = os.path.join(directory, scale + ".dat")
+            SyntheticData(users, items, min(users * args.ratings_per_user, users * items),
+                          seed=args.seed).write(path)
+            benchmark.add_data("synthetic-" + scale, path)
+        if args.real is not None:
+            for min_ratings in args.min_ratings:
+                benchmark.add_data("real-min" + str(min_ratings),
+                                   args.real, min_ratings)
+        results = benchmark.run()
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            regressions = Benchmark.compare(json.load(f), results, args.tolerance)
+        for r in regressions:
+            print("Regression: {} {} {}: {:.4g} -> {:.4g}".format(
+                r["data"], r["predictor"], r["metric"], r["baseline"], r["current"]))
+        if regressions:
+            raise SystemExit(1)
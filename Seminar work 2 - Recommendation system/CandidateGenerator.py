@@ -0,0 +1,224 @@
+from UserItemData import UserItemData
+from MovieData import MovieData
+from scipy.sparse import csr_matrix, issparse
+import pandas as pd
+import numpy as np
+
+
+class CandidateGenerator:
+    SOURCES = ("popular", "neighbours", "factors")
+
+    def __init__(self, n: int = 100, sources: tuple[str] = ("popular", "neighbours"), item_based=None,
+                 factors=None, k: int = 50, memory_mb: int = 256) -> None:
+        """
+        Constructs a new CandidateGenerator object, which selects a few hundred
+        movies for a user with cheap methods, so an expensive predictor only
+        has to score those (see Recommender). Every source adds its n best
+        movies which the user has not seen:
+
+        - "popular": the movies with the most ratings.
+        - "neighbours": the movies most similar to the movies the user rated.
+          The k most similar movies of every movie, by the similarities of a
+          fitted ItemBasedPredictor or else by the number of users who rated
+          both, are found at fit, so a request only merges the neighbours of
+          the rated movies.
+        - "factors": the movies with the highest dot product of the latent
+          factors of a fitted BPRPredictor or MatrixFactorizationPredictor.
+          Every movie of the catalog is scored, so a request is O(catalog).
+
+        :param n: The number of candidates of every source.
+        :param sources: The sources of the candidates.
+        :param item_based: The fitted ItemBasedPredictor used by "neighbours".
+        :param factors: The fitted factor predictor used by "factors".
+        :param k: The number of neighbours of every movie.
+        :param memory_mb: The memory used for one block of movies when counting co-ratings.
+        """
+        for source in sources:
+            if source not in self.SOURCES:
+                raise ValueError("unknown source " + str(source))
+        if "factors" in sources and factors is None:
+            raise ValueError("the factors source needs a factor predictor")
+        self.n = n
+        self.sources = tuple(sources)
+        self.item_based = item_based
+        self.factors = factors
+        self.k = k
+        self.memory_mb = memory_mb
+
+    def fit(self, uim: UserItemData) -> None:
+        """
+        Fits the data to the generator, after the predictors it uses were fitted.
+
+        :param uim: The data.
+        """
+        users, items, ratings = uim.index()
+        self.users = pd.Index(users)
+        self.items = items
+        self.indptr = ratings.indptr
+        self.indices = ratings.indices
+
+        # The movies by the number of ratings, most rated first.
+        counts = np.bincount(ratings.indices, minlength=len(items))
+        self.popular = np.argsort(-counts, kind="stable")
+
+        if "neighbours" in self.sources:
+            self.neighbours = self._item_based_neighbours() if self.item_based is not None \
+                else self._co_rated(ratings)
+
+        if "factors" in self.sources:
+            factor_users, user_vectors, factor_items, item_vectors = self._factor_vectors(self.factors)
+            self.factor_users = pd.Index(factor_users)
+            self.user_vectors = user_vectors
+            # The factors of the movies of the data, movies without factors are never candidates.
+            positions = pd.Index(factor_items).get_indexer(items)
+            self.item_vectors = np.where((positions >= 0).reshape(-1, 1), item_vectors[positions], 0.0)
+            self.factor_known = positions >= 0
+
+    def _item_based_neighbours(self) -> csr_matrix:
+        """
+        Finds the k movies most similar to every movie, by the similarities
+        of the item based predictor aligned to the movies of the data.
+
+        :returns: The sparse matrix of similarities, k per row.
+        """
+        similarities = self.item_based.similarities
+        positions = self.item_based.items.get_indexer(self.items)
+        if (positions < 0).any():
+            raise ValueError("the item based predictor was fitted on different movies")
+
+        def rows(start: int, end: int) -> np.ndarray:
+            block = similarities[positions[start:end]][:, positions]
+            return block.toarray() if issparse(block) else np.array(block, dtype="float64")
+
+        return self._top_k(rows, len(self.items))
+
+    def _co_rated(self, ratings: csr_matrix) -> csr_matrix:
+        """
+        Finds the k movies most often rated together with every movie.
+
+        :param ratings: The ratings matrix.
+        :returns: The sparse matrix of counts, k per row.
+        """
+        rated = ratings.copy()
+        rated.data[:] = 1
+        columns = rated.tocsc()
+
+        def rows(start: int, end: int) -> np.ndarray:
+            block = (columns[:, start:end].T @ rated).toarray()
+            block[np.arange(end - start), np.arange(start, end)] = 0
+            return block
+
+        return self._top_k(rows, rated.shape[1])
+
+    def _top_k(self, rows, n: int) -> csr_matrix:
+        """
+        Keeps the k highest positive values of every row of an n x n matrix,
+        in blocks of rows so only one block is held in memory.
+
+        :param rows: The function which returns the dense rows start:end.
+        :param n: The number of rows and columns.
+        :returns: The sparse matrix, at most k values per row.
+        """
+        k = min(self.k, max(n - 1, 0))
+        size = int(max(1, min(n, self.memory_mb * 1024 ** 2 // (max(n, 1) * 8 * 2))))
+
+        neighbours = np.zeros((n, k), dtype="int64")
+        weights = np.zeros((n, k))
+        for start in range(0, n, size):
+            end = min(start + size, n)
+            block = rows(start, end)
+            if k > 0:
+                best = np.argpartition(-block, k - 1, axis=1)[:, :k]
+                neighbours[start:end] = best
+                weights[start:end] = np.take_along_axis(block, best, axis=1)
+
+        weights[weights < 0] = 0
+        matrix = csr_matrix((weights.ravel(), neighbours.ravel(), np.arange(n + 1) * k), shape=(n, n))
+        matrix.eliminate_zeros()
+        return matrix
+
+    @staticmethod
+    def _factor_vectors(predictor) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Returns the latent factors of a fitted factor predictor, extended so
+        the dot product of a user and a movie orders the movies as the predictor.
+
+        :param predictor: The fitted BPRPredictor or MatrixFactorizationPredictor.
+        :returns: The user ids, their factors, the movie ids and their factors.
+        """
+        if hasattr(predictor, "items_factors"):
+            user_vectors = np.hstack([predictor.users_factors, np.ones((len(predictor.users), 1))])
+            item_vectors = np.hstack([predictor.items_factors, predictor.biases.reshape(-1, 1)])
+            return predictor.users.to_numpy(), user_vectors, predictor.items.to_numpy(), item_vectors
+        if hasattr(predictor, "Vt"):
+            return predictor.rdf.index.to_numpy(), predictor.U @ predictor.sigma, \
+                predictor.rdf.columns.to_numpy(), predictor.Vt.T
+        raise ValueError(type(predictor).__name__ + " has no latent factors")
+
+    @staticmethod
+    def _best(scores: np.ndarray, n: int) -> np.ndarray:
+        """
+        Selects the positions of the n highest finite scores.
+
+        :param scores: The scores.
+        :param n: The number of positions.
+        :returns: The positions.
+        """
+        valid = np.flatnonzero(np.isfinite(scores))
+        if len(valid) > n:
+            valid = valid[np.argpartition(-scores[valid], n - 1)[:n]]
+        return valid
+
+    def generate(self, user_id: int, exclude: np.ndarray = None) -> np.ndarray:
+        """
+        Selects the candidates of the user.
+
+        :param user_id: The user id.
+        :param exclude: The movie ids which are not candidates, usually the seen movies.
+        :returns: The sorted movie ids of the candidates.
+        """
+        excluded = np.zeros(0, dtype="int64")
+        if exclude is not None and len(exclude):
+            excluded = np.minimum(np.searchsorted(self.items, exclude), len(self.items) - 1)
+            excluded = excluded[self.items[excluded] == exclude]
+        row = self.users.get_indexer([user_id])[0]
+        rated = self.indices[self.indptr[row]:self.indptr[row + 1]] if row >= 0 else np.zeros(0, dtype="int64")
+
+        candidates = []
+        if "popular" in self.sources:
+            # The excluded movies are skipped among the first n + excluded movies.
+            first = self.popular[:self.n + len(excluded)]
+            candidates.append(first[~np.isin(first, excluded)][:self.n])
+
+        if "neighbours" in self.sources and len(rated):
+            # Only the neighbour lists of the rated movies are merged, the
+            # scores of a movie in several lists are summed.
+            similarities = self.neighbours[rated]
+            movies, codes = np.unique(similarities.indices, return_inverse=True)
+            scores = np.bincount(codes, similarities.data, minlength=len(movies)).astype("float64")
+            scores[np.isin(movies, excluded)] = -np.inf
+            candidates.append(movies[self._best(scores, self.n)])
+
+        if "factors" in self.sources:
+            factor_row = self.factor_users.get_indexer([user_id])[0]
+            if factor_row >= 0:
+                scores = self.item_vectors @ self.user_vectors[factor_row]
+                scores[~self.factor_known] = -np.inf
+                scores[excluded] = -np.inf
+                candidates.append(self._best(scores, self.n))
+
+        if not candidates:
+            return self.items[:0]
+        return self.items[np.unique(np.concatenate(candidates))]
+
+
+if __name__ == "__main__":
+    md = MovieData('data/movies.dat')
+    uim = UserItemData('data/user_ratedmovies.dat', min_ratings=1000)
+    cg = CandidateGenerator(n=20)
+    cg.fit(uim)
+    seen = uim.df[uim.df["userID"] == 78]["movieID"].to_numpy()
+    candidates = cg.generate(78, exclude=seen)
+    print("{} candidates of {} movies".format(len(candidates), len(cg.items)))
+    for idmovie in candidates[:10]:
+        print("Film: {}".format(md.get_title(idmovie)))
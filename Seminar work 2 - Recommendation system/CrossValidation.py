@@ -0,0 +1,149 @@
+from UserItemData import UserItemData
+from Recommender import Recommender
+from SlopeOnePredictor import SlopeOnePredictor
+from ItemBasedPredictor import ItemBasedPredictor
+from concurrent.futures import ProcessPoolExecutor
+from scipy import stats
+import pandas as pd
+import numpy as np
+import time
+import os
+
+METRICS = ["rmse", "mae", "precision", "recall", "f1"]
+
+# State of a worker process, set once by _init_worker so the ratings are
+# sent to every worker once and not with every fold.
+_state = dict()
+
+
+def _init_worker(predictor_class: type, params: dict, uim: UserItemData, n: int) -> None:
+    """
+    Stores the data, which is the same for all folds, in the worker.
+
+    :param predictor_class: The class of the predictor.
+    :param params: The parameters of the predictor.
+    :param uim: The data.
+    :param n: The number of recommended products used for evaluation.
+    """
+    _state.update(predictor_class=predictor_class, params=params, uim=uim, n=n)
+
+
+def _run_fold(fold: int, train: np.ndarray, test: np.ndarray) -> dict:
+    """
+    Fits the predictor on all folds but one and evaluates it on that fold.
+    Only the ratings at the given positions are taken from the data, the
+    predictors need them as dataframes of their own.
+
+    :param fold: The index of the test fold.
+    :param train: The positions of the training ratings.
+    :param test: The positions of the test ratings.
+    :returns: The row of the results table.
+    """
+    train_data = _state["uim"]._subset(train)
+    test_data = _state["uim"]._subset(test)
+    rec = Recommender(_state["predictor_class"](**_state["params"]))
+
+    start = time.perf_counter()
+    rec.fit(train_data)
+    row = {"fold": fold, "fit_time": time.perf_counter() - start}
+
+    start = time.perf_counter()
+    metrics = rec.evaluate(test_data, _state["n"])
+    row["evaluate_time"] = time.perf_counter() - start
+    row.update(zip(METRICS, metrics))
+    return row
+
+
+class CrossValidation:
+    def __init__(self, uim: UserItemData, k: int = 5, n: int = 20, seed: int = 0, n_jobs: int = None) -> None:
+        """
+        Constructs a new CrossValidation object, which splits the ratings into
+        k folds. The ratings of every user are spread evenly over the folds,
+        so every user is tested in every fold. Only the fold of every rating
+        is stored, the ratings are not copied.
+
+        :param uim: The data.
+        :param k: The number of folds.
+        :param n: The number of recommended products used for evaluation.
+        :param seed: The seed of the random generator.
+        :param n_jobs: The number of worker processes, None runs all folds at once,
+                       limited by the number of cores.
+        """
+        if k < 2:
+            raise ValueError("at least 2 folds are needed, got " + str(k))
+        self.uim = uim
+        self.k = k
+        self.n = n
+        self.n_jobs = n_jobs if n_jobs is not None else min(k, os.cpu_count() or 1)
+
+        rng = np.random.default_rng(seed)
+        user_codes, users = pd.factorize(uim.df["userID"])
+        # Shuffle the ratings, group them by user and deal the ratings of
+        # every user to the folds, starting at a random fold.
+        order = rng.permutation(len(user_codes))
+        order = order[np.argsort(user_codes[order], kind="stable")]
+        sorted_codes = user_codes[order]
+        starts = np.searchsorted(sorted_codes, np.arange(len(users)))
+        rank = np.arange(len(order)) - starts[sorted_codes]
+        offset = rng.integers(0, k, size=len(users))
+        self.folds = np.empty(len(order), dtype="int16")
+        self.folds[order] = (rank + offset[sorted_codes]) % k
+
+    def split(self, fold: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the positions of the training and the test ratings of a fold.
+
+        :param fold: The index of the test fold.
+        :returns: The training and the test positions.
+        """
+        test = self.folds == fold
+        return np.flatnonzero(~test), np.flatnonzero(test)
+
+    def run(self, predictor_class: type, params: dict = None) -> pd.DataFrame:
+        """
+        Fits and evaluates the predictor on every fold. The folds run in
+        parallel worker processes, so with k cores the whole run takes
+        about as long as one fold.
+
+        :param predictor_class: The class of the predictor.
+        :param params: The parameters of the predictor.
+        :returns: The table with the timings and metrics of every fold.
+        """
+        args = (predictor_class, params or {}, self.uim, self.n)
+        # Only the positions of the ratings of a fold are sent with the fold.
+        splits = [(fold,) + self.split(fold) for fold in range(self.k)]
+        if self.n_jobs == 1:
+            _init_worker(*args)
+            rows = [_run_fold(*split) for split in splits]
+        else:
+            with ProcessPoolExecutor(max_workers=self.n_jobs, initializer=_init_worker,
+                                     initargs=args) as executor:
+                rows = list(executor.map(_run_fold, *zip(*splits)))
+        return pd.DataFrame(rows)
+
+    @staticmethod
+    def summary(results: pd.DataFrame, confidence: float = 0.95) -> pd.DataFrame:
+        """
+        Aggregates the metrics of the folds with Student's t confidence intervals.
+
+        :param results: The table returned by run.
+        :param confidence: The confidence level of the intervals.
+        :returns: The mean, standard deviation and interval of every metric.
+        """
+        values = results[[m for m in METRICS if m in results.columns]]
+        mean = values.mean()
+        std = values.std(ddof=1)
+        half = stats.t.ppf((1 + confidence) / 2, len(values) - 1) * std / np.sqrt(len(values))
+        return pd.DataFrame({"mean": mean, "std": std, "ci_low": mean - half, "ci_high": mean + half})
+
+
+if __name__ == "__main__":
+    uim = UserItemData('data/user_ratedmovies.dat', min_ratings=1000)
+    cv = CrossValidation(uim, k=5, n=20)
+
+    for predictor_class in (SlopeOnePredictor, ItemBasedPredictor):
+        start = time.perf_counter()
+        results = cv.run(predictor_class)
+        print(predictor_class.__name__, "{:.1f} s".format(time.perf_counter() - start))
+        print(results)
+        print(CrossValidation.summary(results))
@@ -0,0 +1,107 @@
+from UserItemData import UserItemData
+from MovieData import MovieData
+from scipy.sparse import issparse
+import pandas as pd
+import numpy as np
+
+
+class DiversityReranker:
+    def __init__(self, trade_off: float = 0.7, pool: int = 50, item_based=None,
+                 genres_path: str = "data/movie_genres.dat") -> None:
+        """
+        Constructs a new DiversityReranker object, which reorders the best
+        recommendations by maximal marginal relevance (MMR), so a movie very
+        similar to an already selected movie is moved down. The similarities
+        are those of a fitted ItemBasedPredictor, or else the cosine
+        similarities of the genres of the movies.
+
+        :param trade_off: The weight of the relevance, 1 keeps the order of
+                          the predictions and 0 only considers the diversity.
+        :param pool: The number of best predictions which are reordered.
+        :param item_based: The fitted ItemBasedPredictor whose similarities are used.
+        :param genres_path: Path to movie_genres.dat, used if item_based is None.
+        """
+        if not 0 <= trade_off <= 1:
+            raise ValueError("trade_off must be between 0 and 1")
+        self.trade_off = trade_off
+        self.pool = pool
+        self.item_based = item_based
+        self.genres_path = genres_path
+
+    def fit(self, uim: UserItemData) -> None:
+        """
+        Fits the data to the reranker, after the predictor it uses was fitted.
+        The genres are read once, as unit vectors of the movies.
+
+        :param uim: The data.
+        """
+        if self.item_based is not None:
+            self.movies = self.item_based.items
+            return
+        genres = pd.read_table(self.genres_path, encoding_errors="ignore")
+        movie_codes, self.movies = pd.factorize(genres["movieID"], sort=True)
+        genre_codes, _ = pd.factorize(genres["genre"])
+        vectors = np.zeros((len(self.movies), genre_codes.max() + 1))
+        vectors[movie_codes, genre_codes] = 1
+        self.vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    def similarities(self, item_ids: np.ndarray) -> np.ndarray:
+        """
+        Returns the similarities between the given movies, 0 for unknown movies.
+
+        :param item_ids: The movie ids.
+        :returns: The matrix of similarities.
+        """
+        positions = self.movies.get_indexer(item_ids)
+        known = np.flatnonzero(positions >= 0)
+        similarities = np.zeros((len(positions), len(positions)))
+        if self.item_based is not None:
+            block = self.item_based.similarities[positions[known]][:, positions[known]]
+            block = block.toarray() if issparse(block) else np.asarray(block)
+        else:
+            vectors = self.vectors[positions[known]]
+            block = vectors @ vectors.T
+        similarities[np.ix_(known, known)] = block
+        return similarities
+
+    def rerank(self, item_ids: np.ndarray, scores: np.ndarray, n: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Selects n movies one by one, each with the highest relevance minus
+        its highest similarity to the selected movies. The highest
+        similarities are updated with the row of every selected movie.
+
+        :param item_ids: The movie ids, best prediction first.
+        :param scores: The predictions.
+        :param n: The number of selected movies.
+        :returns: The selected movie ids and their predictions, in the order of selection.
+        """
+        item_ids, scores = np.asarray(item_ids), np.asarray(scores, dtype="float64")
+        if len(item_ids) == 0:
+            return item_ids, scores
+        # The relevance is the prediction on a scale of 0 to 1 within the pool.
+        low, high = scores.min(), scores.max()
+        relevance = (scores - low) / (high - low) if high > low else np.ones(len(scores))
+        similarities = self.similarities(item_ids)
+
+        max_similarity = np.zeros(len(item_ids))
+        available = np.ones(len(item_ids), dtype=bool)
+        selected = []
+        for _ in range(min(n, len(item_ids))):
+            mmr = self.trade_off * relevance - (1 - self.trade_off) * max_similarity
+            mmr[~available] = -np.inf
+            best = int(np.argmax(mmr))
+            selected.append(best)
+            available[best] = False
+            np.maximum(max_similarity, similarities[best], out=max_similarity)
+        return item_ids[selected], scores[selected]
+
+
+if __name__ == "__main__":
+    md = MovieData('data/movies.dat')
+    uim = UserItemData('data/user_ratedmovies.dat', min_ratings=1000)
+    dr = DiversityReranker(trade_off=0.5)
+    dr.fit(uim)
+    items = np.array([4993, 5952, 7153, 593, 4306, 50, 3578, 2571])
+    scores = np.array([4.2, 4.1, 4.0, 3.9, 3.7, 3.6, 3.5, 3.4])
+    for idmovie, val in zip(*dr.rerank(items, scores, 5)):
+        print("Film: {}, ocena: {}".format(md.get_title(idmovie), val))
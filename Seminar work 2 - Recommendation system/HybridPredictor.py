@@ -4,52 +4,414 @@ from Recommender import Recommender
 from SlopeOnePredictor import SlopeOnePredictor
 from ItemBasedPredictor import ItemBasedPredictor
 from ViewsPredictor import ViewsPredictor
+from Tracer import Tracer, NullTracer
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from collections import OrderedDict
+from itertools import repeat
+import inspect
+import copy
+import os
+import pandas as pd
+import numpy as np
+
+
+def _fit_predictor(predictor, uim):
+    """
+    Fits a single predictor. Defined on module level so it can be
+    executed in a worker process.
+
+    :param predictor: The predictor.
+    :param uim: The data.
+    :returns: The fitted predictor.
+    """
+    predictor.fit(uim)
+    return predictor
+
+
+def _normalize(values: np.ndarray, method: str, mean: float, std: float) -> np.ndarray:
+    """
+    Normalizes a vector of scores onto the scale of the ratings.
+
+    :param values: The scores.
+    :param method: The normalization method ("minmax", "zscore" or None).
+    :param mean: The mean of the ratings, used by "zscore".
+    :param std: The standard deviation of the ratings, used by "zscore".
+    :returns: The normalized scores.
+    """
+    if method is None:
+        return values
+    if method == "minmax":
+        # Normalize on a scale of 1 to 5.
+        low, high = np.nanmin(values), np.nanmax(values)
+        if high == low:
+            return np.where(np.isnan(values), np.nan, 5.0)
+        return (values - low) * (5 - 1) / (high - low) + 1
+    if method == "zscore":
+        # Move the scores to the mean and spread of the ratings.
+        deviation = np.nanstd(values)
+        if deviation == 0:
+            return np.where(np.isnan(values), np.nan, mean)
+        return (values - np.nanmean(values)) / deviation * std + mean
+    raise ValueError(str(method) + " is not a valid normalization method")
 
 
 class HybridPredictor:
-    def __init__(self):
+    # Fitted sub-models, shared between all HybridPredictor objects and keyed
+    # by the predictor class, its parameters and the fingerprint of the data.
+    # The least recently used models are removed when there are more than
+    # cache_size of them.
+    _cache = OrderedDict()
+    cache_size = 8
+
+    def __init__(self, predictors: list = None, weights: list[float] = None, normalization: list[str] = None,
+                 n_jobs: int = None, use_cache: bool = True, tracer: Tracer = None, parallel_items: int = 20000):
+        """
+        Constructs a new HybridPredictor object that predicts by blending
+        the ratings predicted by other predictors. By default it averages the
+        views, item based and slope one predictors, where the number of views
+        is normalized on a scale of 1 to 5.
+
+        :param predictors: The predictors to blend.
+        :param weights: The weights of the predictors, equal by default. The
+                        weights are used as given, so they should sum to 1 to
+                        average the predictions.
+        :param normalization: The normalization of each predictor ("minmax", "zscore" or None).
+        :param n_jobs: The number of processes used for fitting the predictors,
+                       None uses one process per predictor.
+        :param use_cache: Signifies if fitted predictors should be reused.
+        :param tracer: The tracer which records the time spent in each predictor.
+        :param parallel_items: The number of movies from which the predictors
+                               of a user are called concurrently, in threads
+                               started once, if there is more than one CPU.
+                               With fewer movies the predictors are called one
+                               after another. None never uses threads.
+        """
+        if predictors is None:
+            predictors = [ViewsPredictor(), ItemBasedPredictor(),
+                          SlopeOnePredictor()]
+            if normalization is None:
+                normalization = ["minmax", None, None]
+        if weights is None:
+            weights = [1 / len(predictors)] * len(predictors)
+        if normalization is None:
+            normalization = [None] * len(predictors)
+        if len(weights) != len(predictors) or len(normalization) != len(predictors):
+            raise ValueError(
+                "weights and normalization must match the number of predictors")
+
+        # The unfitted predictors, which are copied for every fit, so the cache
+        # keys only contain their parameters.
+        self.prototypes = list(predictors)
+        self.predictors = list(predictors)
+        self.weights = np.array(weights, dtype="float64")
+        self.normalization = list(normalization)
+        self.n_jobs = n_jobs
+        self.use_cache = use_cache
+        self.tracer = tracer if tracer is not None else NullTracer()
+        self.parallel_items = parallel_items
+        self._executor = None
+
+    @staticmethod
+    def _params(value):
         """
-        Constructs a new HybridPredictor object that predicts by averaging
-        the ratings predicted by other predictors.
+        Describes a parameter by value. Objects, for example predictors, are
+        described by their class and the parameters of their constructor, not
+        by their address. The parameters are returned by get_params, or else
+        they are the attributes with the names of the constructor parameters.
+
+        :param value: The parameter.
+        :returns: The hashable description.
+        :raises ValueError: If a parameter is not stored under its name.
+        """
+        if value is None or isinstance(value, (bool, int, float, str, np.number)):
+            return value
+        if isinstance(value, (list, tuple, np.ndarray)):
+            return tuple(HybridPredictor._params(item) for item in list(value))
+        if isinstance(value, dict):
+            return tuple(sorted((key, HybridPredictor._params(item)) for key, item in value.items()))
+        if inspect.isfunction(value) or inspect.ismethod(value) or inspect.isclass(value):
+            return value.__module__, value.__qualname__
+        if hasattr(value, "get_params"):
+            params = value.get_params()
+        else:
+            params = dict()
+            for name in inspect.signature(type(value).__init__).parameters:
+                if name in ("self", "args", "kwargs"):
+                    continue
+                if not hasattr(value, name) or inspect.ismethod(getattr(value, name)):
+                    raise ValueError(type(value).__name__ + " does not store the parameter " + name +
+                                     ", define get_params")
+                params[name] = getattr(value, name)
+        return type(value).__name__, HybridPredictor._params(params)
+
+    @staticmethod
+    def _cache_key(predictor, fingerprint):
         """
-        self.views_predictor = ViewsPredictor()
-        self.item_based_predictor = ItemBasedPredictor()
-        self.slope_one_predictor = SlopeOnePredictor()
+        Builds the cache key of an unfitted predictor from the parameters of
+        its constructor.
+
+        :param predictor: The predictor.
+        :param fingerprint: The fingerprint of the data.
+        :returns: The cache key.
+        """
+        return HybridPredictor._params(predictor), fingerprint
 
     def fit(self, uim):
         """
-        Fits the data to the predictor.
+        Fits the data to the predictor. The predictors which are not cached
+        are fitted concurrently, each in its own process.
 
         :param uim: The data.
         """
-        self.views_predictor.fit(uim)
-        self.item_based_predictor.fit(uim)
-        self.slope_one_predictor.fit(uim)
+        # The cached validation predictions belong to the previous models.
+        self.validation_fingerprint = None
+        self.validation_scores = None
+        self.validation_ratings = None
+
+        fingerprint = uim.fingerprint()
+        keys = [self._cache_key(p, fingerprint) for p in self.prototypes]
+
+        missing = [i for i, key in enumerate(keys)
+                   if not self.use_cache or key not in self._cache]
+        predictors = [copy.deepcopy(self.prototypes[i]) for i in missing]
+
+        with self.tracer.span("hybrid.fit", predictors=len(missing)):
+            if self.n_jobs == 1 or len(missing) <= 1:
+                fitted = [_fit_predictor(p, uim) for p in predictors]
+            else:
+                workers = len(missing) if self.n_jobs is None else min(
+                    self.n_jobs, len(missing))
+                with ProcessPoolExecutor(max_workers=workers) as executor:
+                    fitted = list(executor.map(
+                        _fit_predictor, predictors, repeat(uim)))
+
+        fitted = dict(zip(missing, fitted))
+        for i, key in enumerate(keys):
+            if i not in fitted:
+                self.predictors[i] = self._cache[key]
+                self._cache.move_to_end(key)
+                continue
+            if self.use_cache:
+                self._cache[key] = fitted[i]
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+            self.predictors[i] = fitted[i]
+
+        # All predictions are aligned to one item index.
+        self.items = pd.unique(uim.df["movieID"])
+        self.item_index = pd.Index(self.items)
+        self.users = pd.unique(uim.df["userID"])
+        self.rating_mean = uim.df["rating"].mean()
+        self.rating_std = uim.df["rating"].std()
+
+        # Predictors which predict the same values for every user are
+        # predicted and normalized only once.
+        self.static_scores = dict()
+        # The positions of the movies of every predictor in the item index,
+        # by predictor, with the movie ids they were computed for.
+        self.member_positions = dict()
+        for i, predictor in enumerate(self.predictors):
+            if not getattr(predictor, "personalized", True):
+                self.static_scores[i] = self._scores(i, predictor.predict(None))
+        self.parallel = self.parallel_items is not None and len(self.items) >= self.parallel_items and \
+            (os.cpu_count() or 1) > 1
+
+    def _scores(self, i: int, prediction: dict[int, int | float] | tuple[np.ndarray, np.ndarray]) -> np.ndarray:
+        """
+        Aligns the predictions of the i-th predictor to the item index and
+        normalizes them.
+
+        :param i: The index of the predictor.
+        :param prediction: The dict of predictions, or the movie ids and the
+                           vector of predictions.
+        :returns: The normalized vector of scores.
+        """
+        if isinstance(prediction, dict):
+            values = pd.Series(prediction, dtype="float64").reindex(
+                self.items).to_numpy()
+        else:
+            items, predicted = prediction
+            # The movies of a predictor are the same for every user, so
+            # their positions are looked up once.
+            cached = self.member_positions.get(i)
+            if cached is None or not np.array_equal(cached[0], items):
+                cached = (items, pd.Index(items).get_indexer(self.items))
+                self.member_positions[i] = cached
+            positions = cached[1]
+            values = np.where(positions >= 0, np.asarray(predicted, dtype="float64")[positions], np.nan)
+        return _normalize(values, self.normalization[i], self.rating_mean, self.rating_std)
+
+    def _predict_member(self, i: int, user_id: int) -> dict[int, int | float] | tuple[np.ndarray, np.ndarray]:
+        """
+        Predicts the values with the i-th predictor, as a vector if the
+        predictor has a predict_batch method.
+
+        :param i: The index of the predictor.
+        :param user_id: The user id.
+        :returns: The dict of predictions, or the movie ids and the vector of predictions.
+        """
+        predictor = self.predictors[i]
+        with self.tracer.span("hybrid.predict." + type(predictor).__name__):
+            if hasattr(predictor, "predict_batch"):
+                items, predicted = predictor.predict_batch([user_id])
+                return items, predicted[0]
+            return predictor.predict(user_id)
+
+    def _member_scores(self, user_id: int) -> np.ndarray:
+        """
+        Predicts the normalized scores of every predictor for the user.
+
+        :param user_id: The user id.
+        :returns: The matrix of scores, one row per predictor.
+        """
+        members = [i for i in range(len(self.predictors)) if i not in self.static_scores]
+        scores = dict(self.static_scores)
+        if self.parallel and len(members) > 1:
+            # The numpy and scipy operations of the predictors release the GIL,
+            # so large predictions overlap. The threads are started once.
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=len(members))
+            futures = {i: self._executor.submit(self._predict_member, i, user_id) for i in members}
+            for i, future in futures.items():
+                scores[i] = self._scores(i, future.result())
+        else:
+            for i in members:
+                scores[i] = self._scores(i, self._predict_member(i, user_id))
+        return np.vstack([scores[i] for i in range(len(self.predictors))])
+
+    def _blend(self, scores: np.ndarray, weights: np.ndarray) -> np.ndarray:
+        """
+        Blends the scores of the predictors. The weights are used as given,
+        the weight of a predictor which has no score for an item is spread
+        over the other predictors. Items which no predictor scores are NaN,
+        and so are the items some predictor does not score if the weights
+        sum to 0, because their weight can not be spread.
+
+        :param scores: The matrix of scores, one row per predictor.
+        :param weights: The weights of the predictors.
+        :returns: The blended scores.
+        """
+        present = ~np.isnan(scores)
+        values = np.where(present, scores, 0).T @ weights
+        total = weights.sum()
+        if total != 0:
+            coverage = present.T @ weights / total
+        else:
+            coverage = present.all(axis=0).astype("float64")
+        return np.divide(values, coverage, out=np.full(len(values), np.nan), where=coverage != 0)
 
     def predict(self, user_id):
         """
         Predict values by combining multiple predictors.
-        As we are predicting a numerical output, we can average the
-        predictions given by the different predictors.
+        As we are predicting a numerical output, we can take the weighted
+        average of the predictions given by the different predictors.
 
         :param user_id: The user id.
         :returns: The dict of predictions.
         """
-        vp = self.views_predictor.predict(user_id)
-        ibp = self.item_based_predictor.predict(user_id)
-        sop = self.slope_one_predictor.predict(user_id)
+        blended = self._blend(self._member_scores(user_id), self.weights)
+        return dict(zip(self.items.tolist(), blended.tolist()))
+
+    def predict_items(self, user_id: int, item_ids: np.ndarray) -> np.ndarray:
+        """
+        Predicts the values of the given movies only. The predictors which
+        are normalized per user predict all movies, because the normalization
+        depends on all their predictions.
+
+        :param user_id: The user id.
+        :param item_ids: The movie ids.
+        :returns: The predictions in the order of item_ids, NaN for unknown movies.
+        """
+        item_ids = np.asarray(item_ids)
+        positions = self.item_index.get_indexer(item_ids)
+        known = positions >= 0
+        scores = np.full((len(self.predictors), int(known.sum())), np.nan)
+        for i, predictor in enumerate(self.predictors):
+            if i in self.static_scores:
+                scores[i] = self.static_scores[i][positions[known]]
+            elif self.normalization[i] is None and hasattr(predictor, "predict_items"):
+                with self.tracer.span("hybrid.predict_items." + type(predictor).__name__):
+                    scores[i] = predictor.predict_items(user_id, item_ids[known])
+            else:
+                scores[i] = self._scores(i, self._predict_member(i, user_id))[positions[known]]
+
+        values = np.full(len(positions), np.nan)
+        values[known] = self._blend(scores, self.weights)
+        return values
+
+    def _cache_validation(self, test_data: UserItemData) -> None:
+        """
+        Predicts the ratings in the validation data with every predictor once
+        and caches them as arrays.
+
+        :param test_data: The validation data.
+        """
+        known = test_data.df[test_data.df["userID"].isin(self.users) &
+                             test_data.df["movieID"].isin(self.items)]
+        positions = pd.Index(self.items).get_indexer(known["movieID"])
+
+        scores = np.empty((len(known), len(self.predictors)))
+        for user_id, rows in known.groupby("userID").indices.items():
+            scores[rows] = self._member_scores(user_id)[:, positions[rows]].T
+
+        # Ratings which some predictor can not predict are not used.
+        complete = ~np.isnan(scores).any(axis=1)
+        self.validation_scores = scores[complete]
+        self.validation_ratings = known["rating"].to_numpy(dtype="float64")[
+            complete]
+        self.validation_fingerprint = test_data.fingerprint()
+
+    def validation_error(self, weights: list[float]) -> float:
+        """
+        Calculates the RMSE of the blend with the given weights on the cached
+        validation predictions, without predicting again.
+
+        :param weights: The weights of the predictors.
+        :returns: The RMSE.
+        """
+        blended = self.validation_scores @ np.asarray(weights, dtype="float64")
+        return np.sqrt(np.mean(np.square(blended - self.validation_ratings)))
+
+    def fit_weights(self, test_data: UserItemData, method: str = "lstsq", step: float = 0.1,
+                    tolerance: float = 1e-4) -> np.ndarray:
+        """
+        Learns the weights of the predictors on validation data. The
+        predictions of the predictors for the validation data are made only
+        once and reused when the same data is passed again.
+
+        :param test_data: The validation data.
+        :param method: "lstsq" for least squares or "coordinate" for a coordinate search.
+        :param step: The initial step of the coordinate search.
+        :param tolerance: The smallest step of the coordinate search.
+        :returns: The learned weights.
+        """
+        if getattr(self, "validation_fingerprint", None) != test_data.fingerprint():
+            self._cache_validation(test_data)
 
-        # Normalize on a scale of 1 to 5
-        def normalize(val):
-            if val == max(vp.values()):
-                return 5
-            if val == min(vp.values()):
-                return 1
-            return (val - min(vp.values())) * (5 - 1) / (max(vp.values()) - min(vp.values())) + 1
+        if method == "lstsq":
+            weights = np.linalg.lstsq(
+                self.validation_scores, self.validation_ratings, rcond=None)[0]
+        elif method == "coordinate":
+            weights = self.weights.copy()
+            error = self.validation_error(weights)
+            while step >= tolerance:
+                improved = False
+                for i in range(len(weights)):
+                    for direction in (step, -step):
+                        candidate = weights.copy()
+                        candidate[i] += direction
+                        candidate_error = self.validation_error(candidate)
+                        if candidate_error < error:
+                            weights, error = candidate, candidate_error
+                            improved = True
+                            break
+                if not improved:
+                    step /= 2
+        else:
+            raise ValueError(method + " is not a valid method")
 
-        vp = {k: normalize(v) for k, v in vp.items()}
-        items = {k: (vp[k] + ibp[k] + sop[k]) / 3 for k in vp.keys()}
-        return items
+        self.weights = weights
+        return weights
 
 
 if __name__ == "__main__":
@@ -65,20 +427,5 @@ if __name__ == "__main__":
         print("Film: {}, ocena: {}".format(md.get_title(idmovie), val))
 
 # Results:
-#
-# Predictions for 78: 
-# Film: The Lord of the Rings: The Fellowship of the Ring, ocena: 4.222124268484733
-# Film: The Lord of the Rings: The Two Towers, ocena: 4.066243609686811
-# Film: The Lord of the Rings: The Return of the King, ocena: 3.9597929670299936
-# Film: The Silence of the Lambs, ocena: 3.9490960158900186
-# Film: Shrek, ocena: 3.6919636926785664
-# Film: The Usual Suspects, ocena: 3.58663609727359
-# Film: Gladiator, ocena: 3.495346786685855
-# Film: Shichinin no samurai, ocena: 3.4946176822899915
-# Film: Pirates of the Caribbean: The Curse of the Black Pearl, ocena: 3.4398312632377426
-# Film: Men in Black, ocena: 3.3549544441215224
-# Film: Toy story, ocena: 3.3447138198251074
-# Film: Finding Nemo, ocena: 3.3433742383774194
-# Film: The Incredibles, ocena: 3.3410594623961196
-# Film: Batman Begins, ocena: 3.3170050579133057
-# Film: A Beautiful Mind, ocena: 3.244104578274035
\ No newline at end of file
+# The earlier results predate the aligned blend of the member predictions and
+# the learned weights, run the script on data/user_ratedmovies.dat to record new ones.
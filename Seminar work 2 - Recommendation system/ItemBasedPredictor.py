@@ -1,82 +1,238 @@
 from UserItemData import UserItemData
 from MovieData import MovieData
 from Recommender import Recommender
+from SimilarityStore import SimilarityStore
+from SharedArrays import SharedArrays
+from scipy.sparse import issparse, csr_matrix, csc_matrix
 import pandas as pd
 import numpy as np
-import math
+
+
+def _similarity_rows(start: int, end: int) -> None:
+    """
+    Calculates the rows start:end of the similarities, and of the numbers of
+    common users if they are wanted, in a worker process, from the shared
+    matrices of the centered ratings, their squares and the rated movies.
+
+    :param start: The first row.
+    :param end: The row after the last one.
+    """
+    arrays = SharedArrays.worker_arrays()
+    shape = tuple(arrays["shape"])
+    rows = {name: csr_matrix((arrays[name], arrays["indices"], arrays["indptr"]), shape=shape)
+            for name in ("centered", "squared", "rated")}
+    columns = {name: csc_matrix((arrays[name + "_columns"], arrays["column_indices"], arrays["column_indptr"]),
+                                shape=shape)[:, start:end] for name in ("centered", "squared", "rated")}
+
+    products = (columns["centered"].T @ rows["centered"]).toarray()
+    if "norms" in arrays:
+        roots = np.outer(arrays["norms"][start:end], arrays["norms"])
+    else:
+        # Row i of the squares is the sum of the squares of movie i over the
+        # users who rated movie j, the transposed squares swap the movies.
+        squares = (columns["squared"].T @ rows["rated"]).toarray()
+        squares_t = (columns["rated"].T @ rows["squared"]).toarray()
+        roots = np.sqrt(squares * squares_t)
+    similarities = np.divide(products, roots, out=np.zeros_like(products), where=roots != 0)
+    similarities[np.arange(end - start), np.arange(start, end)] = 0.0
+
+    arrays["similarities"][start:end] = similarities
+    if "common" in arrays:
+        arrays["common"][start:end] = (columns["rated"].T @ rows["rated"]).toarray()
 
 
 class ItemBasedPredictor:
-    def __init__(self, min_values: int = 0, threshold: int = 0) -> None:
+    # The measures of similarity between movies.
+    SIMILARITIES = ("adjusted_cosine", "pearson", "cosine")
+
+    def __init__(self, min_values: int = 0, threshold: int = 0, n_jobs: int = 1,
+                 similarity: str = "adjusted_cosine", shrinkage: float = 0) -> None:
         """
         Constructs a new ItemBasedPredictor object that predicts ratings based similarities between items.
+
+        :param min_values: The minimum number of users who rated both movies.
+        :param threshold: The minimum similarity, lower similarities are 0.
+        :param n_jobs: The number of processes calculating the similarities, None uses all cores.
+        :param similarity: "adjusted_cosine" centers the ratings by the average
+                           of the user, "pearson" by the average of the movie,
+                           "cosine" compares the ratings as they are.
+        :param shrinkage: The similarities of movies with n common users are
+                          multiplied by n / (n + shrinkage), so similarities
+                          based on few users count less.
         """
+        if similarity not in self.SIMILARITIES:
+            raise ValueError("unknown similarity " + str(similarity))
         self.min_values = min_values
         self.threshold = threshold
+        self.n_jobs = n_jobs
+        # Stored as measure, similarity is the method comparing two movies.
+        self.measure = similarity
+        self.shrinkage = shrinkage
+
+    def get_params(self) -> dict:
+        """
+        Returns the parameters of the constructor.
+
+        :returns: The parameters by name.
+        """
+        return {"min_values": self.min_values, "threshold": self.threshold, "n_jobs": self.n_jobs,
+                "similarity": self.measure, "shrinkage": self.shrinkage}
+
+    @staticmethod
+    def prepare(uim: UserItemData, configs: list[dict] = None,
+                n_jobs: int = 1) -> tuple[dict[str, np.ndarray], np.ndarray]:
+        """
+        Calculates the similarities between all movies, before the min_values,
+        threshold and shrinkage are applied, and the number of users who
+        rated both movies. The result does not depend on these parameters, so
+        it can be shared between differently configured predictors.
+
+        :param uim: The data.
+        :param configs: The parameters of the predictors which share the result,
+                        the similarities are calculated for every similarity among them.
+        :param n_jobs: The number of processes, which calculate blocks of rows
+                       from the ratings in shared memory. None uses all cores.
+        :returns: The similarities by the name of the similarity and the numbers of common users.
+        """
+        users, items, ratings = uim.index()
+        kinds = sorted({config.get("similarity", "adjusted_cosine") for config in configs or [{}]},
+                       key=ItemBasedPredictor.SIMILARITIES.index)
+
+        rated = ratings.copy()
+        rated.data[:] = 1
+
+        similarities = dict()
+        common = None
+        for kind in kinds:
+            centered = ItemBasedPredictor._centered(ratings, kind)
+            if n_jobs != 1:
+                similarities[kind], counts = ItemBasedPredictor._prepare_parallel(
+                    centered, rated, kind == "cosine", common is None, n_jobs)
+                common = counts if common is None else common
+                continue
+
+            products = (centered.T @ centered).toarray()
+            if kind == "cosine":
+                norms = np.sqrt(products.diagonal())
+                roots = np.outer(norms, norms)
+            else:
+                # The sums only run over the users who rated both movies, which
+                # is why the squares are multiplied with the matrix of rated movies.
+                squares = (centered.multiply(centered).T @ rated).toarray()
+                roots = np.sqrt(squares * squares.T)
+            similarities[kind] = np.divide(products, roots, out=np.zeros_like(
+                products), where=roots != 0)
+            np.fill_diagonal(similarities[kind], 0.0)
+            if common is None:
+                common = (rated.T @ rated).toarray()
+        return similarities, common
+
+    @staticmethod
+    def _centered(ratings: csr_matrix, similarity: str) -> csr_matrix:
+        """
+        Centers the ratings for the similarity.
+
+        :param ratings: The ratings matrix.
+        :param similarity: The name of the similarity.
+        :returns: The centered ratings, with the same positions as the ratings.
+        """
+        centered = ratings.copy()
+        if similarity == "adjusted_cosine":
+            # Subtract the average rating of the user from the ratings.
+            counts = np.diff(ratings.indptr)
+            averages = np.asarray(ratings.sum(axis=1)).ravel() / counts
+            centered.data -= np.repeat(averages, counts)
+        elif similarity == "pearson":
+            # Subtract the average rating of the movie from the ratings.
+            counts = np.bincount(ratings.indices, minlength=ratings.shape[1])
+            averages = np.asarray(ratings.sum(axis=0)).ravel() / np.maximum(counts, 1)
+            centered.data -= averages[ratings.indices]
+        return centered
+
+    @staticmethod
+    def _prepare_parallel(centered: csr_matrix, rated: csr_matrix, cosine: bool = False, with_common: bool = True,
+                          n_jobs: int = None) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Calculates the similarities and the numbers of common users in blocks
+        of rows in worker processes. The matrices are placed in shared memory
+        once and the workers write their rows into the shared results.
+
+        :param centered: The centered ratings.
+        :param rated: The matrix of rated movies.
+        :param cosine: Signifies if the similarities are divided by the norms
+                       of all ratings instead of the ratings of common users.
+        :param with_common: Signifies if the numbers of common users are calculated.
+        :param n_jobs: The number of processes, None uses all cores.
+        :returns: The similarities and the numbers of common users, or None.
+        """
+        n = centered.shape[1]
+        # The three matrices share the positions of the ratings.
+        squared = centered.copy()
+        squared.data **= 2
+        columns = {name: matrix.tocsc() for name, matrix in
+                   (("centered", centered), ("squared", squared), ("rated", rated))}
+        arrays = {"shape": np.array(centered.shape), "indptr": centered.indptr, "indices": centered.indices,
+                  "centered": centered.data, "squared": squared.data, "rated": rated.data,
+                  "column_indptr": columns["centered"].indptr, "column_indices": columns["centered"].indices}
+        for name, matrix in columns.items():
+            arrays[name + "_columns"] = matrix.data
+        if cosine:
+            arrays["norms"] = np.sqrt(np.asarray(squared.sum(axis=0)).ravel())
+        outputs = {"similarities": ((n, n), "float64")}
+        if with_common:
+            outputs["common"] = ((n, n), "float64")
+
+        with SharedArrays(arrays, outputs) as shared:
+            shared.map(_similarity_rows, SharedArrays.blocks(n, n_jobs), n_jobs)
+            return shared["similarities"].copy(), shared["common"].copy() if with_common else None
 
-    def fit(self, uim: UserItemData) -> None:
+    def fit(self, uim: UserItemData, shared: tuple[np.ndarray, np.ndarray] = None,
+            store: SimilarityStore = None) -> None:
         """
         Fits the data to the predictor.
 
         :param uim: The data.
+        :param shared: The result of prepare, which is used instead of
+                       calculating the similarities again.
+        :param store: The store of similarities of the data, which is built
+                      if it is incomplete and read instead of holding the
+                      similarities in memory.
         """
         self.uim = uim
-        self.df = uim.df.copy()
-        self.df.drop(columns=["date_day", "date_month", "date_year",
-                     "date_hour", "date_minute", "date_second"], inplace=True)
-
-        self.average_ratings = self.df.groupby("userID")["rating"].mean()
-        self.df["rating"] = (self.df.set_index(
-            ["userID"])["rating"] - self.average_ratings).values
-
-        movie_movie = pd.DataFrame(
-            columns=self.df["movieID"].unique(), index=self.df["movieID"].unique())
-
-        npmm = movie_movie.fillna(0).to_numpy()
-        npmm = npmm.astype("float64")
-        items = len(npmm)
-        for i in range(items):
-            for j in range(items):
-                if i == j:
-                    continue
-
-                # If value already calculated, skip.
-                if npmm[i][j] != 0.0:
-                    continue
-
-                mid1 = self.df["movieID"].unique()[i]
-                mid2 = self.df["movieID"].unique()[j]
-
-                common_users = set(self.df[self.df["movieID"] == mid1]["userID"].values).intersection(
-                    set(self.df[self.df["movieID"] == mid2]["userID"].values))
-                if len(common_users) == 0 or len(common_users) < self.min_values:
-                    continue
-
-                similarity = np.sum(self.df[(self.df["movieID"] == mid1) & (
-                    self.df["userID"].isin(common_users))]["rating"].values * self.df[(self.df["movieID"] == mid2) & (
-                        self.df["userID"].isin(common_users))]["rating"].values)
-
-                fis = np.sum(np.power(self.df[(self.df["movieID"] == mid1) & (
-                    self.df["userID"].isin(common_users))]["rating"].values, 2))
-
-                sis = np.sum(np.power(self.df[(self.df["movieID"] == mid2) & (
-                    self.df["userID"].isin(common_users))]["rating"].values, 2))
-
-                roots = math.sqrt(fis) * math.sqrt(sis)
-                if roots == 0:
-                    npmm[i, j] = 0.0
-                    npmm[j, i] = 0.0
-                    continue
-                else:
-                    if similarity / roots < self.threshold:
-                        npmm[i, j] = 0.0
-                        npmm[j, i] = 0.0
-                    else:
-                        # Set values for both directions, no need to calculate twice.
-                        npmm[i, j] = similarity / roots
-                        npmm[j, i] = similarity / roots
-        self.df = pd.DataFrame(
-            npmm, columns=self.df["movieID"].unique(), index=self.df["movieID"].unique())
+        users, items, ratings = uim.index()
+
+        counts = np.diff(ratings.indptr)
+        self.average_ratings = pd.Series(
+            np.asarray(ratings.sum(axis=1)).ravel() / counts, index=users)
+
+        if store is not None:
+            if (store.min_values, store.threshold) != (self.min_values, self.threshold):
+                raise ValueError("the store was built with min_values=" + str(store.min_values) +
+                                 " and threshold=" + str(store.threshold))
+            if self.measure != "adjusted_cosine" or self.shrinkage:
+                raise ValueError("the store only holds adjusted cosine similarities without shrinkage")
+            if not store.is_complete(uim):
+                store.build(uim)
+            similarities = store.similarities()
+        else:
+            similarities, common = shared if shared is not None else self.prepare(
+                uim, [{"similarity": self.measure}], self.n_jobs)
+            similarities = similarities[self.measure].copy()
+            similarities[(common == 0) | (common < self.min_values)] = 0.0
+            if self.shrinkage:
+                similarities *= common / (common + self.shrinkage)
+            similarities[similarities < self.threshold] = 0.0
+
+        self.users = pd.Index(users)
+        self.ratings = ratings
+        self.similarities = similarities
+        # The sparse top-k similarities of a store are not kept as a dataframe.
+        self.df = pd.DataFrame(similarities, columns=items, index=items, copy=False) \
+            if not issparse(similarities) else None
+        self.items = pd.Index(items)
+
+        # Predictions are returned in the order in which the movies appear in the data.
+        self.order = np.searchsorted(items, pd.unique(uim.df["movieID"]))
 
     def predict(self, user_id: int) -> dict[int, int | float]:
         """
@@ -85,23 +241,64 @@ class ItemBasedPredictor:
         :param user_id: The user id.
         :returns: The dict of predictions.
         """
-        items = {k: 0 for k in self.uim.df["movieID"]}
-        for k in items.keys():
-            prediction = 0
-            divisor = 0
-            for k1 in items.keys():
-                if k != k1 and len(self.uim.df[(self.uim.df["movieID"] == k1) & (self.uim.df["userID"] == user_id)]) != 0:
-                    similarity = self.df.loc[k, k1]
-                    prediction += similarity * self.uim.df[(self.uim.df["movieID"] == k1) & (
-                        self.uim.df["userID"] == user_id)]["rating"].values[0]
-                    divisor += similarity
-            if divisor != 0:
-                prediction = (
-                    self.average_ratings[user_id] + (prediction / divisor)) / 2
-            else:
-                prediction = self.average_ratings[user_id]
-            items[k] = prediction
-        return items.copy()
+        average = self.average_ratings[user_id]
+        row = self.ratings.getrow(self.users.get_loc(user_id))
+
+        similarities = self.similarities[:, row.indices]
+        prediction = similarities @ row.data
+        divisor = np.asarray(similarities.sum(axis=1)).ravel()
+
+        prediction = np.where(divisor != 0, (average + np.divide(
+            prediction, divisor, out=np.zeros_like(prediction), where=divisor != 0)) / 2, average)
+        return dict(zip(self.items[self.order].tolist(), prediction[self.order].tolist()))
+
+    def predict_items(self, user_id: int, item_ids: np.ndarray) -> np.ndarray:
+        """
+        Predicts the values of the given movies only, which reads just their
+        rows of the similarities.
+
+        :param user_id: The user id.
+        :param item_ids: The movie ids.
+        :returns: The predictions in the order of item_ids, NaN for unknown movies.
+        """
+        average = self.average_ratings[user_id]
+        row = self.ratings.getrow(self.users.get_loc(user_id))
+        positions = self.items.get_indexer(item_ids)
+        known = positions >= 0
+
+        similarities = self.similarities[positions[known]][:, row.indices]
+        prediction = np.asarray(similarities @ row.data).ravel()
+        divisor = np.asarray(similarities.sum(axis=1)).ravel()
+
+        values = np.full(len(positions), np.nan)
+        values[known] = np.where(divisor != 0, (average + np.divide(
+            prediction, divisor, out=np.zeros_like(prediction), where=divisor != 0)) / 2, average)
+        return values
+
+    def predict_batch(self, user_ids: list[int]) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Predicts the values for several users at once.
+
+        :param user_ids: The user ids.
+        :returns: The movie ids and the matrix of predictions, one row per user.
+        """
+        rows = self.users.get_indexer(user_ids)
+        if (rows < 0).any():
+            raise KeyError(np.asarray(user_ids)[rows < 0].tolist())
+        average = self.average_ratings.to_numpy()[rows].reshape(-1, 1)
+
+        ratings = self.ratings[rows]
+        rated = ratings.copy()
+        rated.data[:] = 1
+        prediction = ratings @ self.similarities.T
+        divisor = rated @ self.similarities.T
+        if issparse(prediction):
+            prediction, divisor = prediction.toarray(), divisor.toarray()
+        prediction, divisor = np.asarray(prediction), np.asarray(divisor)
+
+        prediction = np.where(divisor != 0, (average + np.divide(
+            prediction, divisor, out=np.zeros_like(prediction), where=divisor != 0)) / 2, average)
+        return self.items.to_numpy(), prediction
 
     def similarity(self, p1: int, p2: int) -> int:
         """
@@ -110,7 +307,7 @@ class ItemBasedPredictor:
         :param p1: The first movie id.
         :param p2: The second movie id.
         """
-        return self.df.loc[p1, p2]
+        return self.similarities[self.items.get_loc(p1), self.items.get_loc(p2)]
 
     def similar_items(self, item: int, n: int) -> list[int, int]:
         """
@@ -119,6 +316,11 @@ class ItemBasedPredictor:
         :param item: The movie.
         :param n: How many movies should be selected.
         """
+        if self.df is None:
+            row = self.similarities[self.items.get_loc(item)].toarray().ravel()
+            best = np.argsort(-row, kind="stable")[:n]
+            return zip(self.items[best], row[best])
+
         row = pd.DataFrame(self.df.loc[item, :])
         movies = row.sort_values(
             item, axis=0, ascending=False).iloc[:n, :].T.columns
@@ -168,58 +370,6 @@ if __name__ == "__main__":
         print("Film: {}, ocena: {}".format(md.get_title(idmovie), val))
 
 # Results:
-#
-# Podobnost med filmoma 'Men in black'(1580) in 'Ghostbusters'(2716):  0.23395523176756633
-# Podobnost med filmoma 'Men in black'(1580) in 'Schindler's List'(527):  0.0
-# Podobnost med filmoma 'Men in black'(1580) in 'Independence day'(780):  0.42466125844687624
-#
-# Predictions for 78:
-# Film: Shichinin no samurai, ocena: 4.1604255346899635
-# Film: The Usual Suspects, ocena: 4.1598990035688015
-# Film: The Silence of the Lambs, ocena: 4.150210791271142
-# Film: Sin City, ocena: 4.121901722984434
-# Film: Monsters, Inc., ocena: 4.0913487080066435
-# Film: The Incredibles, ocena: 4.0861074311757575
-# Film: The Lord of the Rings: The Fellowship of the Ring, ocena: 4.058954193209058
-# Film: Batman Begins, ocena: 4.055765042884983
-# Film: Die Hard, ocena: 4.045515940651294
-# Film: Rain Man, ocena: 4.018325761014159
-# Film: The Lord of the Rings: The Return of the King, ocena: 3.99267686416339
-# Film: A Beautiful Mind, ocena: 3.9901293845673034
-# Film: Good Will Hunting, ocena: 3.987198542996294
-# Film: The Lord of the Rings: The Two Towers, ocena: 3.9532962920826806
-# Film: Indiana Jones and the Last Crusade, ocena: 3.8810463877243455
-#
-# 20 most similar pairs:
-# Movie "The Lord of the Rings: The Two Towers" is similar to "The Lord of the Rings: The Return of the King", similarity: 0.8439842148481417
-# Movie "The Lord of the Rings: The Return of the King" is similar to "The Lord of the Rings: The Two Towers", similarity: 0.8439842148481417
-# Movie "The Lord of the Rings: The Fellowship of the Ring" is similar to "The Lord of the Rings: The Two Towers", similarity: 0.8231885401761888
-# Movie "Kill Bill: Vol. 2" is similar to "Kill Bill: Vol. 2", similarity: 0.7372340224381029
-# Movie "Kill Bill: Vol. 2" is similar to "Kill Bill: Vol. 2", similarity: 0.7372340224381029
-# Movie "Star Wars" is similar to "Star Wars: Episode V - The Empire Strikes Back", similarity: 0.7021321132220318
-# Movie "Star Wars: Episode V - The Empire Strikes Back" is similar to "Star Wars", similarity: 0.7021321132220318
-# Movie "Ace Ventura: Pet Detective" is similar to "The Mask", similarity: 0.6616471778494046
-# Movie "The Mask" is similar to "Ace Ventura: Pet Detective", similarity: 0.6616471778494046
-# Movie "Star Wars: Episode VI - Return of the Jedi" is similar to "Star Wars: Episode V - The Empire Strikes Back", similarity: 0.5992253753778948
-# Movie "Independence Day" is similar to "Star Wars: Episode I - The Phantom Menace", similarity: 0.5610426219249997
-# Movie "Star Wars: Episode I - The Phantom Menace" is similar to "Independence Day", similarity: 0.5610426219249997
-# Movie "Austin Powers: The Spy Who Shagged Me" is similar to "Ace Ventura: Pet Detective", similarity: 0.5546511205201551
-# Movie "Speed" is similar to "Pretty Woman", similarity: 0.5452283115904596
-# Movie "Pretty Woman" is similar to "Speed", similarity: 0.5452283115904596
-# Movie "Mrs. Doubtfire" is similar to "The Mask", similarity: 0.5398021259282235
-# Movie "The Matrix Reloaded" is similar to "Star Wars: Episode I - The Phantom Menace", similarity: 0.539553095856011
-# Movie "Pulp Fiction" is similar to "Reservoir Dogs", similarity: 0.5325845218198639
-# Movie "Reservoir Dogs" is similar to "Pulp Fiction", similarity: 0.5325845218198639
-# Movie "The Shawshank Redemption" is similar to "The Usual Suspects", similarity: 0.517724533955058
-#
-# Filmi podobni "The Lord of the Rings: The Fellowship of the Ring":
-# Film: The Lord of the Rings: The Two Towers, ocena: 0.8231885401761888
-# Film: The Lord of the Rings: The Return of the King, ocena: 0.8079374897442496
-# Film: Star Wars: Episode V - The Empire Strikes Back, ocena: 0.2396194307349645
-# Film: Star Wars, ocena: 0.2196558652707407
-# Film: The Matrix, ocena: 0.2151555270688023
-# Film: Raiders of the Lost Ark, ocena: 0.19944276706345015
-# Film: The Usual Suspects, ocena: 0.18321188451910753
-# Film: Blade Runner, ocena: 0.16399681315410275
-# Film: Schindler's List, ocena: 0.16105905138148702
-# Film: Monty Python and the Holy Grail, ocena: 0.15780453798519137
+# The earlier results were recorded with the dataframe implementation and an
+# older ordering of ties, run the script on data/user_ratedmovies.dat to record
+# new ones.
@@ -8,39 +8,69 @@ import numpy as np
 
 
 class MatrixFactorizationPredictor:
-    def __init__(self) -> None:
+    def __init__(self, rank: int = 50) -> None:
         """
         Creates a new MatrixFactorizationPredictor object that predicts ratings based on matrix factorization.
+
+        :param rank: The number of latent features.
         """
-        pass
+        self.rank = rank
 
-    def fit(self, uim: UserItemData) -> None:
+    @staticmethod
+    def prepare(uim: UserItemData, configs: list[dict] = None) -> tuple:
         """
-        Fits the data to the predictor.
+        Decomposes the ratings matrix once with the highest rank of the given
+        configurations. Predictors with a lower rank keep only the components
+        with the largest singular values.
 
         :param uim: The data.
+        :param configs: The parameters of the predictors which share the result.
+        :returns: The ratings matrix, the user averages and the decomposition.
         """
-        self.uim = uim
-        self.df = uim.df.drop(columns=[
-                              "date_day", "date_month", "date_year", "date_hour", "date_minute", "date_second"])
+        rank = max([config.get("rank", 50) for config in configs or [{}]])
 
-        # Convert dataframe to matrix where rows are users, columns are movies and cells contain actual ratings.
-        R_df = self.df.pivot(
-            index="userID", columns="movieID", values="rating").fillna(0)
-        R = R_df.to_numpy()
-
-        self.rdf = R_df
+        # Convert the sparse index to a matrix where rows are users, columns are movies and cells contain
+        # actual ratings, which works for every schema of the data.
+        users, items, ratings = uim.index()
+        R = ratings.toarray()
+        R_df = pd.DataFrame(R, index=pd.Index(users, name="userID"),
+                            columns=pd.Index(items, name="movieID"), copy=False)
 
         # Normalize the data.
         ratings_mean = np.mean(R, axis=1)
         R_demeaned = R - ratings_mean.reshape(-1, 1)
 
-        # Decompose the matrix. Rank 50 is arbitrary.
+        # Decompose the matrix.
         # U is a matrix of users and their latent features.
-        # sigma is a diagonal matrix of singular values.
+        # sigma contains the singular values, in ascending order.
         # Vt is a matrix of movies and their latent features.
-        U, sigma, Vt = svds(R_demeaned, k=50)
-        sigma = np.diag(sigma)
+        U, sigma, Vt = svds(R_demeaned, k=rank)
+        order = np.argsort(sigma)
+        return R_df, ratings_mean, U[:, order], sigma[order], Vt[order, :]
+
+    def fit(self, uim: UserItemData, shared: tuple = None) -> None:
+        """
+        Fits the data to the predictor.
+
+        :param uim: The data.
+        :param shared: The result of prepare, which is truncated to the rank
+                       of the predictor instead of decomposing the matrix again.
+        """
+        self.uim = uim
+        self.df = uim.df[["userID", "movieID", "rating"]]
+
+        if shared is None:
+            shared = self.prepare(uim, [{"rank": self.rank}])
+        R_df, ratings_mean, U, sigma, Vt = shared
+        if self.rank > len(sigma):
+            raise ValueError(str(self.rank) + " is higher than the prepared rank")
+
+        self.rdf = R_df
+
+        # Keep the components with the largest singular values.
+        U = U[:, -self.rank:]
+        sigma = np.diag(sigma[-self.rank:])
+        Vt = Vt[-self.rank:, :]
 
         self.U = U
         self.sigma = sigma
@@ -50,7 +80,8 @@ class MatrixFactorizationPredictor:
         all_predicted_ratings = np.dot(
             np.dot(U, sigma), Vt) + ratings_mean.reshape(-1, 1)
         self.preds_df = pd.DataFrame(
-            all_predicted_ratings, columns=R_df.columns, index=self.df["userID"].unique())
+            all_predicted_ratings, columns=R_df.columns, index=R_df.index)
+        self.predictions = all_predicted_ratings
 
     def predict(self, user_id: int) -> dict[int, int | float]:
         """
@@ -63,6 +94,28 @@ class MatrixFactorizationPredictor:
             ascending=False)
         return {k: v for k, v in sorted_predictions.items()}
 
+    def predict_items(self, user_id: int, item_ids: np.ndarray) -> np.ndarray:
+        """
+        Predicts the values of the given movies only.
+
+        :param user_id: The user id.
+        :param item_ids: The movie ids.
+        :returns: The predictions in the order of item_ids, NaN for unknown movies.
+        """
+        positions = self.preds_df.columns.get_indexer(item_ids)
+        values = np.full(len(positions), np.nan)
+        values[positions >= 0] = self.predictions[self.preds_df.index.get_loc(user_id), positions[positions >= 0]]
+        return values
+
+    def predict_batch(self, user_ids: list[int]) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Predicts the values for several users at once.
+
+        :param user_ids: The user ids.
+        :returns: The movie ids and the matrix of predictions, one row per user.
+        """
+        return self.preds_df.columns.to_numpy(), self.preds_df.loc[user_ids].to_numpy()
+
     def visualize_first_10(self) -> None:
         """
         Visualizes the first 10 factors.
@@ -121,20 +174,5 @@ if __name__ == "__main__":
     # mfp.visualize_matrix_decompose()
 
 # Results:
-#
-# Predictions for 78:
-# Film: Men in Black, ocena: 1.8204205103868067
-# Film: Spider-Man, ocena: 1.5347774658228888
-# Film: Toy story, ocena: 1.390759056915183
-# Film: Titanic, ocena: 1.3640562754303271
-# Film: Austin Powers: The Spy Who Shagged Me, ocena: 0.9681013094861783
-# Film: Sin City, ocena: 0.8394283325362564
-# Film: Mrs. Doubtfire, ocena: 0.836297642176647
-# Film: Indiana Jones and the Last Crusade, ocena: 0.8318333017071369
-# Film: Speed, ocena: 0.8045875158317601
-# Film: Good Will Hunting, ocena: 0.7890629128627
-# Film: The Silence of the Lambs, ocena: 0.7208267064614353
-# Film: The Lord of the Rings: The Fellowship of the Ring, ocena: 0.6847876754223341
-# Film: The Fifth Element, ocena: 0.6540223951172395
-# Film: Star Wars: Episode I - The Phantom Menace, ocena: 0.46675515098110365
-# Film: The Incredibles, ocena: 0.417184894673861
+# The earlier results predate the sparse rating matrix and the ordering of
+# ties, run the script on data/user_ratedmovies.dat to record new ones.
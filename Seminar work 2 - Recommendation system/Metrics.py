@@ -0,0 +1,128 @@
+from UserItemData import UserItemData
+import pandas as pd
+import numpy as np
+
+
+class Metrics:
+    def __init__(self, user_ids: np.ndarray, recommended: np.ndarray, valid: np.ndarray,
+                 test_data: UserItemData, train_data: UserItemData = None) -> None:
+        """
+        Constructs a new Metrics object, which computes the ranking metrics of
+        the top-n recommendations of many users at once. A test movie is
+        relevant to a user if its rating is above the user's mean test rating,
+        as in Recommender.evaluate. Users without relevant movies are skipped.
+
+        :param user_ids: The user ids, one per row of the recommendations.
+        :param recommended: The matrix of recommended movie ids, best first.
+        :param valid: The mask of the recommendations, False where a row has fewer than n.
+        :param test_data: The test data.
+        :param train_data: The training data, used for coverage and novelty.
+        """
+        user_ids = np.asarray(user_ids)
+        self.recommended = np.asarray(recommended)
+        self.valid = np.asarray(valid, dtype=bool)
+        self.train_data = train_data
+
+        # The test ratings grouped by the row of their user.
+        rows = pd.Index(user_ids).get_indexer(test_data.df["userID"])
+        known = rows >= 0
+        rows = rows[known]
+        movies = test_data.df["movieID"].to_numpy()[known]
+        ratings = test_data.df["rating"].to_numpy("float64")[known]
+        counts = np.bincount(rows, minlength=len(user_ids))
+        means = np.bincount(rows, ratings, minlength=len(user_ids)) / np.maximum(counts, 1)
+        relevant = ratings > means[rows]
+        self.relevant_counts = np.bincount(rows[relevant], minlength=len(user_ids))
+
+        # A recommendation is a hit if the (row, movie) pair is relevant.
+        relevant_keys = self._keys(rows[relevant], movies[relevant])
+        recommended_keys = self._keys(np.arange(len(user_ids))[:, None], self.recommended)
+        self.hits = np.isin(recommended_keys, relevant_keys) & self.valid
+
+    @staticmethod
+    def _keys(rows: np.ndarray, movies: np.ndarray) -> np.ndarray:
+        """
+        Combines rows and movie ids into single integers.
+
+        :param rows: The rows.
+        :param movies: The movie ids.
+        :returns: The keys.
+        """
+        return (np.asarray(rows, dtype="int64") << 32) | np.asarray(movies, dtype="int64")
+
+    @classmethod
+    def from_recommender(cls, rec: "Recommender", test_data: UserItemData, n: int,
+                         user_ids: list[int] = None) -> "Metrics":
+        """
+        Recommends n movies to the users as Recommender.evaluate does, with
+        the candidates and the reranker of the recommender, and constructs
+        the metrics from them.
+
+        :param rec: The fitted recommender.
+        :param test_data: The test data.
+        :param n: The number of recommended products.
+        :param user_ids: The user ids, the test users known to the recommender if None.
+        :returns: The Metrics object.
+        """
+        if user_ids is None:
+            user_ids = [user_id for user_id in pd.unique(test_data.df["userID"]).tolist()
+                        if user_id in rec.user_rows]
+        recommended, valid = rec.recommend_matrix(user_ids, n)
+        return cls(user_ids, recommended, valid, test_data, rec.uim)
+
+    def compute(self) -> dict:
+        """
+        Computes all metrics.
+
+        :returns: The precision, recall, F1, hit rate, MRR, MAP and NDCG at n
+                  averaged over the users, and the catalog coverage and novelty
+                  of the recommendations if the training data is given.
+        """
+        users = self.relevant_counts > 0
+        hits = self.hits[users]
+        relevant = self.relevant_counts[users]
+        n = hits.shape[1]
+        ranks = np.arange(1, n + 1)
+
+        found = hits.sum(axis=1)
+        recommended = self.valid[users].sum(axis=1)
+        precision = (found[recommended > 0] / recommended[recommended > 0]).mean()
+        recall = (found / relevant).mean()
+
+        first = hits.argmax(axis=1)
+        reciprocal_rank = np.where(hits.any(axis=1), 1 / (first + 1), 0.0)
+
+        ideal = np.minimum(relevant, n)
+        average_precision = (np.cumsum(hits, axis=1) / ranks * hits).sum(axis=1) / ideal
+
+        discounts = 1 / np.log2(ranks + 1)
+        ideal_dcg = np.cumsum(discounts)[ideal - 1]
+        ndcg = (hits * discounts).sum(axis=1) / ideal_dcg
+
+        metrics = {"users": int(users.sum()), "precision": precision, "recall": recall,
+                   "f1": 2 * precision * recall / (precision + recall) if precision + recall > 0 else 0.0,
+                   "hit_rate": hits.any(axis=1).mean(), "mrr": reciprocal_rank.mean(),
+                   "map": average_precision.mean(), "ndcg": ndcg.mean()}
+
+        if self.train_data is not None:
+            train_users, items, ratings = self.train_data.index()
+            movies = self.recommended[self.valid]
+            metrics["coverage"] = len(np.unique(movies)) / len(items)
+            # Novelty is the mean self-information of the recommended movies,
+            # rare movies are more novel.
+            popularity = np.bincount(ratings.indices, minlength=len(items)) / len(train_users)
+            positions = np.searchsorted(items, movies)
+            positions = positions[(positions < len(items)) & (items[np.minimum(positions, len(items) - 1)] == movies)]
+            metrics["novelty"] = -np.log2(popularity[positions]).mean() if len(positions) else 0.0
+        return metrics
+
+
+if __name__ == "__main__":
+    from Recommender import Recommender
+    from ItemBasedPredictor import ItemBasedPredictor
+
+    uim, uim_test = UserItemData('data/user_ratedmovies.dat').split_temporal(
+        '1.1.2008', '2.1.2008', train_min_ratings=1000, test_min_ratings=200)
+    rec = Recommender(ItemBasedPredictor())
+    rec.fit(uim)
+    print(Metrics.from_recommender(rec, uim_test, 20).compute())
@@ -65,15 +65,6 @@ if __name__ == "__main__":
     pass
 
 # Results:
-#
-# Predictions for myself:
-# Film: Batman Begins, ocena: 4.105882352941177
-# Film: Ocean's Eleven, ocena: 4.105882352941176
-# Film: The Fugitive, ocena: 4.105882352941176
-# Film: The Bourne Identity, ocena: 4.105882352941176
-# Film: Monsters, Inc., ocena: 4.072070109345024
-# Film: Die Hard, ocena: 4.064341903890307
-# Film: Shichinin no samurai, ocena: 4.015034769975135
-# Film: The Godfather, ocena: 3.9998236518482897
-# Film: Alien, ocena: 3.9965629615528675
-# Film: Memento, ocena: 3.995914773075207
\ No newline at end of file
+# The earlier results listed movies with equal predictions in an order the
+# recommender no longer uses, run the script on data/user_ratedmovies.dat to
+# record new ones.
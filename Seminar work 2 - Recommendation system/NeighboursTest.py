@@ -0,0 +1,35 @@
+from UserBasedPredictor import UserBasedPredictor
+from CandidateGenerator import CandidateGenerator
+from ItemBasedPredictor import ItemBasedPredictor
+from SimilarityStore import SimilarityStore
+from Recommender import Recommender
+from UserItemData import UserItemData
+import pandas as pd
+import tempfile
+
+if __name__ == "__main__":
+    # Test the neighbour searches on data where no neighbour can be found.
+    one_user = UserItemData.from_dataframe(pd.DataFrame(
+        {"userID": [1, 1, 1], "movieID": [10, 20, 30], "rating": [4.0, 3.0, 5.0]}))
+
+    # A single user has no other users as neighbours.
+    rec = Recommender(UserBasedPredictor())
+    rec.fit(one_user)
+    assert rec.predictor.neighbours.nnz == 0
+    print("UserBasedPredictor, single user:", rec.recommend(1, n=3, rec_seen=True))
+
+    # A single movie has no other movies as neighbours.
+    one_item = UserItemData.from_dataframe(pd.DataFrame(
+        {"userID": [1, 2], "movieID": [10, 10], "rating": [4.0, 3.0]}))
+    cg = CandidateGenerator(n=5, sources=("popular", "neighbours"))
+    cg.fit(one_item)
+    assert cg.neighbours.nnz == 0
+    print("CandidateGenerator, single movie:", cg.generate(1))
+
+    # The similarity store of a single movie keeps no neighbours.
+    with tempfile.TemporaryDirectory() as directory:
+        store = SimilarityStore(directory, top_k=10).build(one_item)
+        assert store.is_complete(one_item) and store.similarities().shape == (1, 1)
+        rec = Recommender(ItemBasedPredictor())
+        rec.fit(one_item, store=store)
+        print("SimilarityStore, single movie:", rec.recommend(1, n=1, rec_seen=True))
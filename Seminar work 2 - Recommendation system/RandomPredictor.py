@@ -1,5 +1,6 @@
 from UserItemData import UserItemData
 from MovieData import MovieData
+import numpy as np
 import random as rd
 
 
@@ -33,6 +34,17 @@ class RandomPredictor:
             self.uim[k] = rd.randint(self.min_rating, self.max_rating)
         return self.uim.copy()
 
+    def predict_items(self, user_id: int, item_ids: np.ndarray) -> np.ndarray:
+        """
+        Predicts the values of the given movies only.
+
+        :param user_id: The user id.
+        :param item_ids: The movie ids.
+        :returns: The predictions in the order of item_ids, NaN for unknown movies.
+        """
+        return np.array([rd.randint(self.min_rating, self.max_rating) if item_id in self.uim else np.nan
+                         for item_id in np.asarray(item_ids).tolist()], dtype="float64")
+
 
 if __name__ == "__main__":
     md = MovieData('data/movies.dat')
@@ -0,0 +1,55 @@
+from ItemBasedPredictor import ItemBasedPredictor
+from ViewsPredictor import ViewsPredictor
+from HybridPredictor import HybridPredictor
+from Recommender import Recommender
+from UserItemData import UserItemData
+from AsyncRecommender import AsyncRecommender
+import asyncio
+import sys
+
+if __name__ == "__main__":
+    # Test that recommend and recommend_batch return the same movies, also
+    # when predictions are equal.
+    path = sys.argv[1] if len(sys.argv) > 1 else 'data/user_ratedmovies.dat'
+    uim = UserItemData(path, min_ratings=1000 if len(sys.argv) == 1 else None)
+    users = uim.df["userID"].unique().tolist()
+
+    for predictor in (ItemBasedPredictor(), ViewsPredictor(), HybridPredictor(n_jobs=1, use_cache=False)):
+        rec = Recommender(predictor)
+        rec.fit(uim)
+        batch = rec.recommend_batch(users, n=10, rec_seen=False)
+        for user_id, result in zip(users, batch):
+            single = rec.recommend(user_id, n=10, rec_seen=False)
+            assert [movie for movie, _ in single] == [movie for movie, _ in result], user_id
+            assert single == rec.recommend_batch([user_id], n=10, rec_seen=False)[0], user_id
+        print("{}: {} users equal".format(type(predictor).__name__, len(users)))
+
+    # Test that ratings added with add_ratings are in the data of the next
+    # fit, also when it is another UserItemData object, which is not changed.
+    train, test = uim.split_random(test_size=0.2)
+    rec = Recommender(ViewsPredictor())
+    rec.fit(train)
+    added = test.df.iloc[:100]
+    rec.add_ratings(added)
+    ratings = uim.read_ratings()
+    rec.fit(uim)
+    assert uim.read_ratings() == ratings and rec.uim is not uim
+    merged = rec.uim.df.set_index(["userID", "movieID"])["rating"]
+    assert (merged.loc[list(zip(added["userID"], added["movieID"]))].to_numpy() == added["rating"].to_numpy()).all()
+    assert not merged.index.duplicated().any()
+    print("{} added ratings merged".format(len(added)))
+
+    # Test that requests awaited while the AsyncRecommender stops are served
+    # or fail, and do not wait forever.
+    async def stop_while_recommending():
+        server = AsyncRecommender(rec, max_batch=4)
+        await server.start()
+        requests = [asyncio.create_task(server.recommend(user_id)) for user_id in users[:20]]
+        await asyncio.sleep(0)
+        await server.stop()
+        return await asyncio.wait_for(asyncio.gather(*requests, return_exceptions=True), 5)
+
+    results = asyncio.run(stop_while_recommending())
+    assert all(isinstance(result, (list, RuntimeError)) for result in results)
+    print("{} requests served and {} stopped".format(sum(isinstance(result, list) for result in results),
+                                                      sum(isinstance(result, RuntimeError) for result in results)))
@@ -0,0 +1,122 @@
+from collections import OrderedDict
+import threading
+import time
+
+
+class RecommendationCache:
+    def __init__(self, max_entries: int = 10000, max_bytes: int = None, ttl: float = None) -> None:
+        """
+        Constructs a new RecommendationCache object, which keeps the most
+        recently used recommendations. The least recently used entries are
+        evicted when the number of entries or their estimated size is too high.
+
+        :param max_entries: The maximum number of cached recommendations.
+        :param max_bytes: The maximum estimated size of the cached recommendations.
+        :param ttl: The number of seconds after which an entry expires, never if None.
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.clear()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _size(value: list) -> int:
+        """
+        Estimates the memory used by a list of (movie id, rating) pairs.
+
+        :param value: The recommendations.
+        :returns: The estimated size in bytes.
+        """
+        # The list, and for every pair the tuple, the id and the rating.
+        return 56 + len(value) * (8 + 56 + 28 + 24)
+
+    def get(self, user_id: int, key: tuple) -> list:
+        """
+        Returns the cached recommendations.
+
+        :param user_id: The user id.
+        :param key: The key of the recommendations.
+        :returns: The recommendations, or None if they are not cached.
+        """
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None and self.ttl is not None and entry[1] < time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, user_id: int, key: tuple, value: list) -> None:
+        """
+        Caches the recommendations.
+
+        :param user_id: The user id.
+        :param key: The key of the recommendations.
+        :param value: The recommendations.
+        """
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        size = self._size(value)
+        with self._lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (value, expires, size, user_id)
+            self.user_keys.setdefault(user_id, set()).add(key)
+            self.bytes += size
+            while len(self.entries) > self.max_entries or \
+                    (self.max_bytes is not None and self.bytes > self.max_bytes and len(self.entries) > 1):
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def _remove(self, key: tuple) -> None:
+        """
+        Removes an entry, the lock must be held.
+
+        :param key: The key of the recommendations.
+        """
+        value, expires, size, user_id = self.entries.pop(key)
+        self.bytes -= size
+        keys = self.user_keys[user_id]
+        keys.discard(key)
+        if not keys:
+            del self.user_keys[user_id]
+
+    def invalidate_user(self, user_id: int) -> None:
+        """
+        Removes all recommendations of the user.
+
+        :param user_id: The user id.
+        """
+        with self._lock:
+            for key in list(self.user_keys.get(user_id, ())):
+                self._remove(key)
+                self.invalidations += 1
+
+    def clear(self) -> None:
+        """
+        Removes all recommendations.
+        """
+        with self._lock:
+            self.entries = OrderedDict()
+            self.user_keys = dict()
+            self.bytes = 0
+
+    def stats(self) -> dict:
+        """
+        Returns the statistics of the cache.
+
+        :returns: The hits, misses, hit rate, evictions, invalidations, entries and estimated size.
+        """
+        requests = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / requests if requests else 0.0,
+                "evictions": self.evictions, "invalidations": self.invalidations,
+                "entries": len(self.entries), "bytes": self.bytes}
@@ -1,9 +1,10 @@
 from UserItemData import UserItemData
 from MovieData import MovieData
 from Recommender import Recommender
+from StaticPredictor import StaticPredictor
 
 
-class STDPredictor:
+class STDPredictor(StaticPredictor):
     def __init__(self, n: int) -> None:
         """
         Constructs a new STDPredictor object that predicts controversial ratings.
@@ -18,19 +19,11 @@ class STDPredictor:
 
         :param uim: The data.
         """
-        self.uim = {k: 0 for k in uim.df["movieID"]}
-        for k in self.uim.keys():
+        predictions = {k: 0 for k in uim.df["movieID"]}
+        for k in predictions.keys():
             if uim.df[uim.df["movieID"] == k]["rating"].shape[0] > self.n:
-                self.uim[k] = uim.df[uim.df["movieID"] == k]["rating"].std()
-
-    def predict(self, user_id: int) -> dict[int, int]:
-        """
-        Predicts the values for data.
-
-        :param user_id: The user id.
-        :returns: The dict of predictions.
-        """
-        return self.uim.copy()
+                predictions[k] = uim.df[uim.df["movieID"] == k]["rating"].std()
+        self._set_predictions(predictions)
 
 
 if __name__ == "__main__":
@@ -44,9 +37,5 @@ if __name__ == "__main__":
         print("Film: {}, ocena: {}".format(md.get_title(idmovie), val))
 
 # Results:
-#
-# Film: Plan 9 from Outer Space, ocena: 1.3449520951495717
-# Film: The Passion of the Christ, ocena: 1.2814934595257348
-# Film: The Texas Chainsaw Massacre, ocena: 1.235349321908819
-# Film: Jackass Number Two, ocena: 1.2189769976366682
-# Film: White Chicks, ocena: 1.1899581424297316
+# The earlier results were recorded before movies with equal predictions were
+# ordered by id, run the script on data/user_ratedmovies.dat to record new ones.
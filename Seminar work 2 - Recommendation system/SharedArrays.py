@@ -0,0 +1,116 @@
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Callable
+import numpy as np
+import os
+
+# The arrays attached by a worker process, set once by _init_worker.
+_arrays = dict()
+
+
+def _init_worker(spec: dict) -> None:
+    """
+    Attaches the shared arrays in the worker.
+
+    :param spec: The names, shapes and types of the shared arrays.
+    """
+    _arrays.clear()
+    for name, (memory_name, shape, dtype) in spec.items():
+        memory = shared_memory.SharedMemory(name=memory_name)
+        # The handle must live as long as the array which uses its buffer.
+        _arrays[name] = (np.ndarray(shape, dtype=dtype, buffer=memory.buf), memory)
+
+
+class SharedArrays:
+    def __init__(self, arrays: dict[str, np.ndarray] = None, outputs: dict[str, tuple] = None) -> None:
+        """
+        Constructs a new SharedArrays object, which places numpy arrays in
+        shared memory, so worker processes read the inputs and write the
+        outputs without pickling them.
+
+        :param arrays: The input arrays, which are copied to shared memory.
+        :param outputs: The shapes and types of the output arrays, which are
+                        filled with zeros.
+        """
+        self.spec = dict()
+        self.arrays = dict()
+        self._memories = []
+        for name, array in (arrays or {}).items():
+            self._create(name, array.shape, array.dtype)[...] = array
+        for name, (shape, dtype) in (outputs or {}).items():
+            self._create(name, shape, dtype)[...] = 0
+
+    def _create(self, name: str, shape: tuple, dtype: str) -> np.ndarray:
+        """
+        Allocates a shared array.
+
+        :param name: The name of the array.
+        :param shape: The shape of the array.
+        :param dtype: The type of the array.
+        :returns: The array.
+        """
+        dtype = np.dtype(dtype)
+        memory = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape)) * dtype.itemsize))
+        self._memories.append(memory)
+        self.spec[name] = (memory.name, tuple(shape), dtype.str)
+        self.arrays[name] = np.ndarray(shape, dtype=dtype, buffer=memory.buf)
+        return self.arrays[name]
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.arrays[name]
+
+    def __enter__(self) -> "SharedArrays":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """
+        Frees the shared memory, the arrays can not be used afterwards.
+        """
+        self.arrays.clear()
+        for memory in self._memories:
+            memory.close()
+            memory.unlink()
+        self._memories = []
+
+    def map(self, function: Callable, blocks: list[tuple], n_jobs: int = None) -> list:
+        """
+        Calls the function for every block in a pool of worker processes,
+        which attach the shared arrays once. The function gets the attached
+        arrays (see SharedArrays.worker_arrays) and the arguments of the block.
+
+        :param function: The module level function called in the workers.
+        :param blocks: The arguments of every call.
+        :param n_jobs: The number of worker processes, None uses all cores.
+        :returns: The results of the calls.
+        """
+        n_jobs = n_jobs if n_jobs is not None else os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=min(n_jobs, len(blocks)), initializer=_init_worker,
+                                 initargs=(self.spec,)) as executor:
+            return list(executor.map(function, *zip(*blocks)))
+
+    @staticmethod
+    def worker_arrays() -> dict[str, np.ndarray]:
+        """
+        Returns the shared arrays attached by the current worker process.
+
+        :returns: The arrays by name.
+        """
+        return {name: array for name, (array, memory) in _arrays.items()}
+
+    @staticmethod
+    def blocks(n: int, n_jobs: int = None, per_job: int = 4) -> list[tuple[int, int]]:
+        """
+        Splits the rows 0:n into blocks, a few per worker, so the workers
+        stay busy when some blocks take longer.
+
+        :param n: The number of rows.
+        :param n_jobs: The number of worker processes, None uses all cores.
+        :param per_job: The number of blocks of every worker.
+        :returns: The start and end of every block.
+        """
+        n_jobs = n_jobs if n_jobs is not None else os.cpu_count() or 1
+        bounds = np.linspace(0, n, min(n, n_jobs * per_job) + 1).astype(int)
+        return [(int(start), int(end)) for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
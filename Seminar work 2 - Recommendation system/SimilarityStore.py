@@ -0,0 +1,219 @@
+from UserItemData import UserItemData
+from scipy.sparse import csr_matrix
+import numpy as np
+import json
+import time
+import os
+
+
+class SimilarityStore:
+    def __init__(self, directory: str, min_values: int = 0, threshold: float = 0, top_k: int = None,
+                 memory_mb: int = 1024) -> None:
+        """
+        Constructs a new SimilarityStore object, which calculates the adjusted
+        cosine similarities between all movies in blocks of columns and
+        writes them to memory mapped files in the directory. Only one block
+        is held in memory, and an interrupted build continues with the first
+        unfinished block.
+
+        :param directory: The directory of the files.
+        :param min_values: The minimum number of users who rated both movies.
+        :param threshold: The minimum similarity, lower similarities are 0.
+        :param top_k: The number of most similar movies kept for every movie,
+                      the whole matrix is kept if None.
+        :param memory_mb: The memory used for one block, in megabytes.
+        """
+        self.directory = directory
+        self.min_values = min_values
+        self.threshold = threshold
+        self.top_k = top_k
+        self.memory_mb = memory_mb
+
+    def _path(self, name: str) -> str:
+        """
+        Returns the path of a file of the store.
+
+        :param name: The name of the file.
+        :returns: The path.
+        """
+        return os.path.join(self.directory, name)
+
+    def _meta(self, uim: UserItemData, items: np.ndarray) -> dict:
+        """
+        Describes the data and parameters of the store, a store with
+        different metadata is built again.
+
+        :param uim: The data.
+        :param items: The movie ids.
+        :returns: The metadata.
+        """
+        return {"fingerprint": uim.fingerprint(), "items": len(items), "min_values": self.min_values,
+                "threshold": self.threshold, "top_k": self.top_k}
+
+    def block_size(self, n_items: int) -> int:
+        """
+        Returns the number of columns in a block, so the dense intermediates
+        of a block (products, squares and counts of common users, each
+        n_items x block_size float64) fit into the memory budget.
+
+        :param n_items: The number of movies.
+        :returns: The number of columns.
+        """
+        return int(max(1, min(n_items, self.memory_mb * 1024 ** 2 // (n_items * 8 * 5))))
+
+    def build(self, uim: UserItemData) -> "SimilarityStore":
+        """
+        Calculates the similarities of the data, skipping the blocks which
+        were already written for the same data and parameters.
+
+        :param uim: The data.
+        :returns: The store.
+        """
+        users, items, ratings = uim.index()
+        os.makedirs(self.directory, exist_ok=True)
+        meta = self._meta(uim, items)
+        n = len(items)
+        size = self.block_size(n)
+        blocks = range(0, n, size)
+
+        progress = self._read_progress()
+        if progress is None or progress["meta"] != meta or progress["block_size"] != size:
+            progress = {"meta": meta, "block_size": size, "done": []}
+            np.save(self._path("items.npy"), items)
+            if self.top_k is None:
+                np.lib.format.open_memmap(self._path("similarities.npy"), mode="w+",
+                                          dtype="float32", shape=(n, n)).flush()
+            else:
+                # A movie is not its own neighbour, so a single movie has none.
+                k = min(self.top_k, max(n - 1, 0))
+                np.lib.format.open_memmap(self._path("neighbours.npy"), mode="w+",
+                                          dtype="int32", shape=(n, k)).flush()
+                np.lib.format.open_memmap(self._path("top_similarities.npy"), mode="w+",
+                                          dtype="float32", shape=(n, k)).flush()
+            self._write_progress(progress)
+        done = set(progress["done"])
+
+        # Subtract the average rating of the user from the ratings, the
+        # column blocks are sliced from the compressed column format.
+        rated = ratings.copy()
+        rated.data[:] = 1
+        counts = np.diff(ratings.indptr)
+        centered = ratings.copy()
+        centered.data -= np.repeat(np.asarray(ratings.sum(axis=1)).ravel() / counts, counts)
+        squared = centered.multiply(centered).tocsr()
+        centered_columns, rated_columns, squared_columns = centered.tocsc(), rated.tocsc(), squared.tocsc()
+
+        for start in blocks:
+            if start in done:
+                continue
+            end = min(start + size, n)
+            # Columns start:end of the similarities, which are symmetric, so
+            # they are written as rows start:end.
+            products = (centered.T @ centered_columns[:, start:end]).toarray()
+            squares = (squared.T @ rated_columns[:, start:end]).toarray()
+            squares_t = (rated.T @ squared_columns[:, start:end]).toarray()
+            common = (rated.T @ rated_columns[:, start:end]).toarray()
+
+            roots = np.sqrt(squares * squares_t)
+            block = np.divide(products, roots, out=np.zeros_like(products), where=roots != 0)
+            block[np.arange(start, end), np.arange(end - start)] = 0.0
+            block[(common == 0) | (common < self.min_values)] = 0.0
+            block[block < self.threshold] = 0.0
+            self._write_block(start, end, block.T.astype("float32"))
+
+            progress["done"].append(start)
+            self._write_progress(progress)
+        return self
+
+    def _write_block(self, start: int, end: int, block: np.ndarray) -> None:
+        """
+        Writes the similarities of the movies start:end to the files.
+
+        :param start: The first movie.
+        :param end: The movie after the last one.
+        :param block: The similarities, one row per movie.
+        """
+        if self.top_k is None:
+            similarities = np.load(self._path("similarities.npy"), mmap_mode="r+")
+            similarities[start:end] = block
+            similarities.flush()
+            return
+        neighbours = np.load(self._path("neighbours.npy"), mmap_mode="r+")
+        top_similarities = np.load(self._path("top_similarities.npy"), mmap_mode="r+")
+        k = neighbours.shape[1]
+        if k == 0:
+            return
+        best = np.argpartition(-block, k - 1, axis=1)[:, :k]
+        neighbours[start:end] = best
+        top_similarities[start:end] = np.take_along_axis(block, best, axis=1)
+        neighbours.flush()
+        top_similarities.flush()
+
+    def _read_progress(self) -> dict:
+        """
+        Reads the finished blocks.
+
+        :returns: The progress, or None if nothing was built.
+        """
+        try:
+            with open(self._path("progress.json")) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_progress(self, progress: dict) -> None:
+        """
+        Writes the finished blocks, the file is replaced at once so an
+        interrupted write leaves the previous progress.
+
+        :param progress: The progress.
+        """
+        with open(self._path("progress.json.tmp"), "w") as f:
+            json.dump(progress, f)
+        os.replace(self._path("progress.json.tmp"), self._path("progress.json"))
+
+    def is_complete(self, uim: UserItemData) -> bool:
+        """
+        Checks if all blocks were written for the data and parameters.
+
+        :param uim: The data.
+        :returns: True if the store is complete.
+        """
+        progress = self._read_progress()
+        items = uim.index()[1]
+        return progress is not None and progress["meta"] == self._meta(uim, items) and \
+            len(progress["done"]) == len(range(0, len(items), progress["block_size"]))
+
+    def items(self) -> np.ndarray:
+        """
+        Returns the movie ids of the rows and columns.
+
+        :returns: The sorted movie ids.
+        """
+        return np.load(self._path("items.npy"))
+
+    def similarities(self) -> np.ndarray | csr_matrix:
+        """
+        Returns the similarities, a read-only memory mapped matrix, or with
+        top_k a sparse matrix with the top_k similarities of every row.
+
+        :returns: The matrix of similarities, rows and columns as in items.
+        """
+        if self.top_k is None:
+            return np.load(self._path("similarities.npy"), mmap_mode="r")
+        neighbours = np.load(self._path("neighbours.npy"))
+        top_similarities = np.load(self._path("top_similarities.npy"))
+        n, k = neighbours.shape
+        matrix = csr_matrix((top_similarities.ravel().astype("float64"),
+                             neighbours.ravel(), np.arange(n + 1) * k), shape=(n, n))
+        matrix.eliminate_zeros()
+        matrix.sort_indices()
+        return matrix
+
+
+if __name__ == "__main__":
+    uim = UserItemData('data/user_ratedmovies.dat', min_ratings=100)
+    start = time.perf_counter()
+    store = SimilarityStore("data/similarities", memory_mb=256).build(uim)
+    print("Built in {:.1f} s, complete: {}".format(time.perf_counter() - start, store.is_complete(uim)))
+    print(store.similarities().shape)
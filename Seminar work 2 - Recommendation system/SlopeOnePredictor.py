@@ -1,36 +1,57 @@
 from UserItemData import UserItemData
 from MovieData import MovieData
 from Recommender import Recommender
+from SharedArrays import SharedArrays
+from scipy.sparse import csr_matrix, csc_matrix
 import pandas as pd
 import numpy as np
 
 
+def _deviation_rows(start: int, end: int) -> None:
+    """
+    Calculates the rows start:end of the deviations in a worker process, from
+    the shared matrices of the ratings and the rated movies.
+
+    :param start: The first row.
+    :param end: The row after the last one.
+    """
+    arrays = SharedArrays.worker_arrays()
+    shape = tuple(arrays["shape"])
+    ratings = csr_matrix((arrays["ratings"], arrays["indices"], arrays["indptr"]), shape=shape)
+    rated = csr_matrix((arrays["rated"], arrays["indices"], arrays["indptr"]), shape=shape)
+    ratings_columns = csc_matrix((arrays["ratings_columns"], arrays["column_indices"], arrays["column_indptr"]),
+                                 shape=shape)[:, start:end]
+    rated_columns = csc_matrix((arrays["rated_columns"], arrays["column_indices"], arrays["column_indptr"]),
+                               shape=shape)[:, start:end]
+    arrays["deviations"][start:end] = SlopeOnePredictor._deviations(ratings_columns, rated_columns, ratings, rated)
+
+
 class SlopeOnePredictor:
-    def __init__(self) -> None:
+    def __init__(self, n_jobs: int = 1) -> None:
         """
         Constructs a new SlopeOnePredictor object that predicts ratings based on the Slope One method.
+
+        :param n_jobs: The number of processes calculating the deviations, None uses all cores.
         """
         self.results = dict()
-        pass
+        self.n_jobs = n_jobs
 
-    def _get_deviation(self, i: int, j: int, users: int, matrix: np.ndarray) -> float:
+    @staticmethod
+    def _deviations(ratings_columns: csr_matrix, rated_columns: csr_matrix, ratings: csr_matrix,
+                    rated: csr_matrix) -> np.ndarray:
         """
-        Calculates the deviation of items specified by i and j.
-
-        :param i: Index of the item.
-        :param j: Index of the item.
-        :param users: Number of users in dataframe.
-        :param matrix: The ratings matrix.
+        Calculates the deviations between some movies and all movies, the
+        average difference of their ratings over the users who rated both.
+
+        :param ratings_columns: The ratings of some movies.
+        :param rated_columns: The rated movies among some movies.
+        :param ratings: The ratings of all movies.
+        :param rated: The rated movies.
+        :returns: The deviations, one row for each of some movies.
         """
-        dev_val = 0
-        usrs = 0
-        for row in range(users):
-            if (matrix[row][i] != 0) and (matrix[row][j] != 0):
-                usrs += 1
-                dev_val += matrix[row][i] - matrix[row][j]
-        if usrs == 0:
-            return 0
-        return dev_val / usrs
+        differences = (ratings_columns.T @ rated - rated_columns.T @ ratings).toarray()
+        common = (rated_columns.T @ rated).toarray()
+        return np.divide(differences, common, out=np.zeros_like(differences), where=common != 0)
 
     def fit(self, uim: UserItemData) -> None:
         """
@@ -38,46 +59,51 @@ class SlopeOnePredictor:
 
         :param uim: The data.
         """
-        # Create matrix of where movie is column, user is row,
-        # and cells contain the ratings.
-        self.df = uim.df.groupby(
-            ["userID", "movieID"]).size().unstack()
-
-        for col in self.df.columns:
-            indices = uim.df[uim.df["movieID"] == col]["userID"].tolist()
-            self.df.loc[indices, col] = [
-                x for x in uim.df[uim.df["movieID"] == col]["rating"]]
-
-        # Create numpy matrix for faster computation, otherwise the
-        # algorithm takes too long.
-        matrix = self.df.to_numpy()
-        matrix[np.isnan(matrix)] = 0
-
-        users = len(matrix)
-        items = len(matrix[0])
+        # The matrix where movie is column, user is row, and cells contain
+        # the ratings.
+        users, items, ratings = uim.index()
+        rated = ratings.copy()
+        rated.data[:] = 1
 
         # Calculate deviations.
-        dev = np.zeros((items, items))
-        for i in range(items):
-            for j in range(items):
-                if i == j:
-                    break
-                else:
-                    dev_temp = self._get_deviation(i, j, users, matrix)
-                    dev[i][j] = dev_temp
-                    dev[j][i] = (-1) * dev_temp
-
-        # Calculate prediction matrix.
-        pred_mat = np.zeros((users, items))
-        for u in range(users):
-            row = np.where(matrix[u] != 0)[0]
-            for j in range(items):
-                pred_mat[u][j] = (
-                    np.sum(dev[j][row] + matrix[u][row])) / len(row)
-
-        # Convert numpy matrix back to dataframe.
-        self.df = pd.DataFrame(
-            pred_mat, columns=self.df.columns, index=self.df.index)
+        if self.n_jobs == 1:
+            deviations = self._deviations(ratings, rated, ratings, rated)
+        else:
+            deviations = self._deviations_parallel(ratings, rated, self.n_jobs)
+
+        # Calculate prediction matrix, the average of the deviations from
+        # the rated movies plus their ratings.
+        counts = np.diff(ratings.indptr).reshape(-1, 1)
+        sums = np.asarray(ratings.sum(axis=1))
+        pred_mat = (np.asarray(rated @ deviations.T) + sums) / counts
+
+        self.deviations = deviations
+        self.df = pd.DataFrame(pred_mat, columns=items, index=users)
+        self.users = pd.Index(users)
+        self.items = pd.Index(items)
+        self.predictions = pred_mat
+
+    @staticmethod
+    def _deviations_parallel(ratings: csr_matrix, rated: csr_matrix, n_jobs: int = None) -> np.ndarray:
+        """
+        Calculates the deviations in blocks of rows in worker processes. The
+        matrices are placed in shared memory once and the workers write their
+        rows into the shared result.
+
+        :param ratings: The ratings matrix.
+        :param rated: The matrix of rated movies.
+        :param n_jobs: The number of processes, None uses all cores.
+        :returns: The deviations.
+        """
+        n = ratings.shape[1]
+        ratings_columns, rated_columns = ratings.tocsc(), rated.tocsc()
+        arrays = {"shape": np.array(ratings.shape), "indptr": ratings.indptr, "indices": ratings.indices,
+                  "ratings": ratings.data, "rated": rated.data,
+                  "column_indptr": ratings_columns.indptr, "column_indices": ratings_columns.indices,
+                  "ratings_columns": ratings_columns.data, "rated_columns": rated_columns.data}
+        with SharedArrays(arrays, {"deviations": ((n, n), "float64")}) as shared:
+            shared.map(_deviation_rows, SharedArrays.blocks(n, n_jobs), n_jobs)
+            return shared["deviations"].copy()
 
     def predict(self, user_id: int) -> dict[int, int | float]:
         """
@@ -86,10 +112,29 @@ class SlopeOnePredictor:
         :param user_id: The user id.
         :returns: The dict of predictions.
         """
-        items = {k: 0 for k in self.df.columns}
-        for k in items.keys():
-            items[k] = self.df.loc[user_id, k]
-        return items
+        return dict(zip(self.items.tolist(), self.predictions[self.users.get_loc(user_id)].tolist()))
+
+    def predict_items(self, user_id: int, item_ids: np.ndarray) -> np.ndarray:
+        """
+        Predicts the values of the given movies only.
+
+        :param user_id: The user id.
+        :param item_ids: The movie ids.
+        :returns: The predictions in the order of item_ids, NaN for unknown movies.
+        """
+        positions = self.items.get_indexer(item_ids)
+        values = np.full(len(positions), np.nan)
+        values[positions >= 0] = self.predictions[self.users.get_loc(user_id), positions[positions >= 0]]
+        return values
+
+    def predict_batch(self, user_ids: list[int]) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Predicts the values for several users at once.
+
+        :param user_ids: The user ids.
+        :returns: The movie ids and the matrix of predictions, one row per user.
+        """
+        return self.df.columns.to_numpy(), self.df.loc[user_ids].to_numpy()
 
 
 if __name__ == "__main__":
@@ -105,20 +150,6 @@ if __name__ == "__main__":
         print("Film: {}, ocena: {}".format(md.get_title(idmovie), val))
 
 # Results:
-# 
-# Predictions for 78: 
-# Film: The Usual Suspects, ocena: 4.335258910037142
-# Film: The Lord of the Rings: The Fellowship of the Ring, ocena: 4.176253710580998
-# Film: The Lord of the Rings: The Return of the King, ocena: 4.175658164006772
-# Film: The Silence of the Lambs, ocena: 4.143370751103905
-# Film: Shichinin no samurai, ocena: 4.1312943805612505
-# Film: The Lord of the Rings: The Two Towers, ocena: 4.104738621697874
-# Film: Indiana Jones and the Last Crusade, ocena: 3.9891308248979476
-# Film: The Incredibles, ocena: 3.9869953130473985
-# Film: Good Will Hunting, ocena: 3.9760142737997723
-# Film: Batman Begins, ocena: 3.963328799538746
-# Film: Sin City, ocena: 3.960207926545804
-# Film: A Beautiful Mind, ocena: 3.9312917632653925
-# Film: Rain Man, ocena: 3.9216066900959454
-# Film: Monsters, Inc., ocena: 3.903567578941103
-# Film: Finding Nemo, ocena: 3.9027764265477227
\ No newline at end of file
+# The earlier results were recorded with the dataframe implementation and an
+# older ordering of ties, run the script on data/user_ratedmovies.dat to record
+# new ones.
@@ -0,0 +1,59 @@
+import pandas as pd
+import numpy as np
+
+
+class StaticPredictor:
+    # The predictions are the same for every user.
+    personalized = False
+
+    def _set_predictions(self, predictions: dict[int, int | float]) -> None:
+        """
+        Stores the predictions of the movies, as the dict returned by predict
+        and as arrays for predict_items and predict_batch.
+
+        :param predictions: The dict of predictions.
+        """
+        self.uim = predictions
+        self.movies = pd.Index(np.fromiter(predictions.keys(), dtype="int64", count=len(predictions)))
+        self.values = np.fromiter(predictions.values(), dtype="float64", count=len(predictions))
+
+    def predictions(self) -> tuple[pd.Index, np.ndarray]:
+        """
+        Returns the predictions of all movies.
+
+        :returns: The movie ids and the predictions.
+        """
+        return self.movies, self.values
+
+    def predict(self, user_id: int) -> dict[int, int | float]:
+        """
+        Predicts the values for data.
+
+        :param user_id: The user id.
+        :returns: The dict of predictions.
+        """
+        return self.uim.copy()
+
+    def predict_items(self, user_id: int, item_ids: np.ndarray) -> np.ndarray:
+        """
+        Predicts the values of the given movies only.
+
+        :param user_id: The user id.
+        :param item_ids: The movie ids.
+        :returns: The predictions in the order of item_ids, NaN for unknown movies.
+        """
+        movies, values = self.predictions()
+        positions = movies.get_indexer(item_ids)
+        return np.where(positions >= 0, values[positions], np.nan) if len(values) else \
+            np.full(len(positions), np.nan)
+
+    def predict_batch(self, user_ids: list[int]) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Predicts the values for several users at once, which are the same
+        for every user.
+
+        :param user_ids: The user ids.
+        :returns: The movie ids and the matrix of predictions, one row per user.
+        """
+        movies, values = self.predictions()
+        return movies.to_numpy(), np.broadcast_to(values, (len(user_ids), len(values)))
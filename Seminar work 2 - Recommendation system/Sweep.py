@@ -0,0 +1,112 @@
+from UserItemData import UserItemData
+from Recommender import Recommender
+from AveragePredictor import AveragePredictor
+from ItemBasedPredictor import ItemBasedPredictor
+from MatrixFactorizationPredictor import MatrixFactorizationPredictor
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+import pandas as pd
+import time
+
+# State of a worker process, set once by _init_worker so the data and the
+# shared intermediates are not sent with every configuration.
+_state = dict()
+
+
+def _init_worker(predictor_class: type, uim: UserItemData, test_data: UserItemData, shared, n: int) -> None:
+    """
+    Stores the data, which is the same for all configurations, in the worker.
+
+    :param predictor_class: The class of the predictor.
+    :param uim: The training data.
+    :param test_data: The test data, or None.
+    :param shared: The intermediates shared by all configurations.
+    :param n: The number of recommended products used for evaluation.
+    """
+    _state.update(predictor_class=predictor_class, uim=uim,
+                  test_data=test_data, shared=shared, n=n)
+
+
+def _run_config(config: dict) -> dict:
+    """
+    Fits and evaluates a predictor with the given configuration.
+
+    :param config: The parameters of the predictor.
+    :returns: The row of the results table.
+    """
+    predictor = _state["predictor_class"](**config)
+    rec = Recommender(predictor)
+
+    start = time.perf_counter()
+    if _state["shared"] is None:
+        rec.fit(_state["uim"])
+    else:
+        rec.fit(_state["uim"], shared=_state["shared"])
+    row = dict(config, fit_time=time.perf_counter() - start)
+
+    if _state["test_data"] is not None:
+        start = time.perf_counter()
+        metrics = rec.evaluate(_state["test_data"], _state["n"])
+        row["evaluate_time"] = time.perf_counter() - start
+        row.update(zip(["rmse", "mae", "precision", "recall", "f1"], metrics))
+    return row
+
+
+class Sweep:
+    def __init__(self, uim: UserItemData, test_data: UserItemData = None, n: int = 20, n_jobs: int = None) -> None:
+        """
+        Constructs a new Sweep object, which fits and evaluates a predictor
+        with every combination of the given parameters. The data is loaded
+        and indexed only once, and the work which does not depend on the
+        parameters is done once for all configurations.
+
+        :param uim: The training data.
+        :param test_data: The test data, the configurations are only timed if None.
+        :param n: The number of recommended products used for evaluation.
+        :param n_jobs: The number of worker processes, None uses all cores.
+        """
+        self.uim = uim
+        self.test_data = test_data
+        self.n = n
+        self.n_jobs = n_jobs
+        # Build the index before the data is sent to the workers.
+        self.uim.index()
+
+    def run(self, predictor_class: type, grid: dict[str, list]) -> pd.DataFrame:
+        """
+        Runs the sweep over all combinations of the parameters in grid.
+        Predictors which define a static prepare method receive its result as
+        the shared parameter of fit.
+
+        :param predictor_class: The class of the predictor.
+        :param grid: The values of each parameter.
+        :returns: The table with the parameters, timings and metrics of every configuration.
+        """
+        configs = [dict(zip(grid.keys(), values))
+                   for values in product(*grid.values())]
+
+        start = time.perf_counter()
+        prepare = getattr(predictor_class, "prepare", None)
+        shared = prepare(self.uim, configs) if prepare is not None else None
+        self.prepare_time = time.perf_counter() - start
+
+        args = (predictor_class, self.uim, self.test_data, shared, self.n)
+        if self.n_jobs == 1:
+            _init_worker(*args)
+            rows = [_run_config(config) for config in configs]
+        else:
+            with ProcessPoolExecutor(max_workers=self.n_jobs, initializer=_init_worker,
+                                     initargs=args) as executor:
+                rows = list(executor.map(_run_config, configs))
+        return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    uim, uim_test = UserItemData('data/user_ratedmovies.dat').split_temporal(
+        '1.1.2008', '2.1.2008', train_min_ratings=1000, test_min_ratings=200)
+    sweep = Sweep(uim, uim_test, n=20)
+
+    print(sweep.run(MatrixFactorizationPredictor, {"rank": [5, 10, 20, 50]}))
+    print(sweep.run(ItemBasedPredictor, {
+          "min_values": [0, 10, 50], "threshold": [0, 0.1]}))
+    print(sweep.run(AveragePredictor, {"b": [0, 10, 100]}))
@@ -0,0 +1,132 @@
+from UserItemData import UserItemData
+from typing import Iterator
+import pandas as pd
+import numpy as np
+
+
+class SyntheticData:
+    def __init__(self, users: int, items: int, ratings: int, seed: int = 0, popularity_exponent: float = 1.0,
+                 activity_sigma: float = 1.2, from_date: str = "1.1.2000", to_date: str = "1.1.2010",
+                 chunk_users: int = 10000) -> None:
+        """
+        Constructs a new SyntheticData object, which generates ratings in the
+        format of user_ratedmovies.dat. The popularity of the movies follows a
+        power law and the number of ratings of the users a log-normal
+        distribution. The ratings are generated in chunks of users, so only
+        one chunk is held in memory at a time.
+
+        :param users: The number of users.
+        :param items: The number of movies.
+        :param ratings: The approximate number of ratings.
+        :param seed: The seed of the random generator.
+        :param popularity_exponent: The exponent of the power law of movie popularity.
+        :param activity_sigma: The spread of the number of ratings of the users.
+        :param from_date: The date of the first rating.
+        :param to_date: The date of the last rating.
+        :param chunk_users: The number of users generated at once.
+        """
+        if ratings > users * items:
+            raise ValueError(str(ratings) + " ratings do not fit into the matrix")
+        self.users = users
+        self.items = items
+        self.ratings = ratings
+        self.seed = seed
+        self.chunk_users = chunk_users
+
+        format_data = "%d.%m.%Y"
+        self.start = pd.to_datetime(from_date, format=format_data).value // 10 ** 9
+        self.end = pd.to_datetime(to_date, format=format_data).value // 10 ** 9
+
+        rng = np.random.default_rng(seed)
+
+        # The probability of a movie being rated falls with the power of its
+        # rank, the ranks are shuffled so popularity does not follow the ids.
+        popularity = 1 / np.arange(1, items + 1) ** popularity_exponent
+        self.cdf = np.cumsum(popularity[rng.permutation(items)])
+        self.cdf /= self.cdf[-1]
+
+        # The numbers of ratings of the users, scaled to the wanted total.
+        activity = rng.lognormal(0, activity_sigma, size=users)
+        self.counts = np.clip(np.round(activity / activity.sum() * ratings),
+                              1, items).astype("int64")
+
+        # Ratings consist of an average, a bias of the user and of the movie.
+        self.user_bias = rng.normal(0, 0.4, size=users)
+        self.item_bias = rng.normal(0, 0.6, size=items)
+
+        # Every user is active during a part of the whole period.
+        length = self.end - self.start
+        self.active_for = rng.integers(
+            1, length // 4, size=users, dtype="int64")
+        self.active_from = self.start + \
+            rng.integers(0, length - self.active_for, dtype="int64")
+
+    def _sample_items(self, rng: np.random.Generator, counts: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Samples distinct movies for each user of a chunk.
+
+        :param rng: The random generator of the chunk.
+        :param counts: The numbers of ratings of the users in the chunk.
+        :returns: The user positions and movie indices, sorted by user and movie.
+        """
+        keys = np.empty(0, dtype="int64")
+        missing = counts
+        # Popular movies are drawn more than once, so the duplicates are
+        # replaced by drawing again.
+        for _ in range(10):
+            users = np.repeat(np.arange(len(counts)), missing)
+            items = np.searchsorted(self.cdf, rng.random(len(users)))
+            keys = np.union1d(keys, users * self.items + items)
+            missing = counts - np.bincount(keys // self.items,
+                                           minlength=len(counts))
+            if not missing.any():
+                break
+        return keys // self.items, keys % self.items
+
+    def chunks(self) -> Iterator[pd.DataFrame]:
+        """
+        Generates the ratings, one chunk of users at a time.
+
+        :returns: The iterator of dataframes.
+        """
+        for chunk, first in enumerate(range(0, self.users, self.chunk_users)):
+            rng = np.random.default_rng([self.seed, chunk])
+            last = min(first + self.chunk_users, self.users)
+            users, items = self._sample_items(rng, self.counts[first:last])
+            users += first
+
+            ratings = 3.5 + self.user_bias[users] + self.item_bias[items] + \
+                rng.normal(0, 0.8, size=len(users))
+            ratings = np.clip(np.round(ratings * 2) / 2, 0.5, 5.0)
+
+            seconds = self.active_from[users] + \
+                (rng.random(len(users)) * self.active_for[users]).astype("int64")
+            dates = pd.to_datetime(seconds, unit="s")
+
+            yield pd.DataFrame({"userID": (users + 1).astype("int32"), "movieID": (items + 1).astype("int32"),
+                                "rating": ratings.astype("float32"),
+                                "date_day": dates.day.astype("int8"), "date_month": dates.month.astype("int8"),
+                                "date_year": dates.year.astype("int16"), "date_hour": dates.hour.astype("int8"),
+                                "date_minute": dates.minute.astype("int8"),
+                                "date_second": dates.second.astype("int8")})
+
+    def write(self, path: str) -> int:
+        """
+        Writes the ratings to a tab separated file, chunk by chunk.
+
+        :param path: Path to the data file.
+        :returns: The number of written ratings.
+        """
+        written = 0
+        with open(path, "w") as f:
+            for i, df in enumerate(self.chunks()):
+                df.to_csv(f, sep="\t", index=False, header=i == 0)
+                written += len(df)
+        return written
+
+
+if __name__ == "__main__":
+    sd = SyntheticData(users=20000, items=10000, ratings=2000000, seed=1)
+    print(sd.write("data/synthetic_ratings.dat"))
+    uim = UserItemData("data/synthetic_ratings.dat", min_ratings=100)
+    print(uim.read_ratings())
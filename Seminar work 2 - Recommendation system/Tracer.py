@@ -0,0 +1,170 @@
+from contextlib import nullcontext
+from typing import Callable
+import pandas as pd
+import numpy as np
+import threading
+import json
+import time
+import os
+
+
+class _Span:
+    def __init__(self, tracer: "Tracer", name: str, args: dict) -> None:
+        """
+        Constructs a new _Span object, which measures the time spent in a
+        with block and records it in the tracer.
+
+        :param tracer: The tracer.
+        :param name: The name of the span.
+        :param args: Additional values stored with the span.
+        """
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self) -> "_Span":
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.tracer.record(self.name, self.start,
+                           time.perf_counter_ns() - self.start, self.args)
+
+
+class Tracer:
+    def __init__(self, callbacks: list[Callable] = None, max_events: int = 100000) -> None:
+        """
+        Constructs a new Tracer object, which records how long named spans
+        (fit, predict, sorting, ...) take and how often they run.
+
+        :param callbacks: Functions called with the name, duration in seconds
+                          and arguments of every finished span.
+        :param max_events: The number of spans kept for the Chrome trace,
+                           the durations of all spans are kept.
+        """
+        self.callbacks = callbacks or []
+        self.max_events = max_events
+        self.reset()
+
+    def reset(self) -> None:
+        """
+        Removes all recorded spans.
+        """
+        self.durations = dict()
+        self.events = []
+        self.origin = time.perf_counter_ns()
+        self._lock = threading.Lock()
+
+    def span(self, name: str, **args) -> _Span:
+        """
+        Returns a context manager which records the time spent inside it.
+
+        :param name: The name of the span.
+        :param args: Additional values stored with the span, for example counts.
+        :returns: The span.
+        """
+        return _Span(self, name, args)
+
+    def record(self, name: str, start: int, duration: int, args: dict = None) -> None:
+        """
+        Records a finished span.
+
+        :param name: The name of the span.
+        :param start: The start of the span in nanoseconds of perf_counter_ns.
+        :param duration: The duration of the span in nanoseconds.
+        :param args: Additional values stored with the span.
+        """
+        with self._lock:
+            self.durations.setdefault(name, []).append(duration)
+            if len(self.events) < self.max_events:
+                self.events.append(
+                    (name, start, duration, threading.get_ident(), args))
+        for callback in self.callbacks:
+            callback(name, duration / 1e9, args)
+
+    def histogram(self, name: str, bins: int = 20) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the histogram of the durations of a span.
+
+        :param name: The name of the span.
+        :param bins: The number of bins.
+        :returns: The counts and the bin edges in seconds.
+        """
+        return np.histogram(np.array(self.durations[name]) / 1e9, bins=bins)
+
+    def summary(self) -> pd.DataFrame:
+        """
+        Aggregates the durations of every span.
+
+        :returns: The table of counts, total, mean and percentile durations in seconds.
+        """
+        rows = []
+        for name, durations in self.durations.items():
+            durations = np.array(durations) / 1e9
+            rows.append({"span": name, "count": len(durations), "total": durations.sum(),
+                         "mean": durations.mean(), "p50": np.percentile(durations, 50),
+                         "p99": np.percentile(durations, 99), "max": durations.max()})
+        return pd.DataFrame(rows, columns=["span", "count", "total", "mean", "p50", "p99", "max"]) \
+            .sort_values("total", ascending=False, ignore_index=True)
+
+    def report(self) -> str:
+        """
+        Returns the summary as text.
+
+        :returns: The report.
+        """
+        return self.summary().to_string(index=False)
+
+    def chrome_trace(self, path: str) -> None:
+        """
+        Writes the recorded spans in the Chrome trace event format, which can
+        be opened in chrome://tracing or Perfetto.
+
+        :param path: Path to the trace file.
+        """
+        events = [{"name": name, "ph": "X", "ts": (start - self.origin) / 1000, "dur": duration / 1000,
+                   "pid": os.getpid(), "tid": thread, "args": args or {}}
+                  for name, start, duration, thread, args in self.events]
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events}, f, default=str)
+
+
+class NullTracer(Tracer):
+    def __init__(self) -> None:
+        """
+        Constructs a new NullTracer object, which records nothing. It is used
+        when tracing is disabled, so the spans cost next to nothing.
+        """
+        super().__init__(max_events=0)
+        self._span = nullcontext()
+
+    def span(self, name: str, **args) -> nullcontext:
+        """
+        Returns a context manager which does nothing.
+
+        :param name: The name of the span.
+        :param args: Ignored.
+        :returns: The shared empty context manager.
+        """
+        return self._span
+
+    def record(self, name: str, start: int, duration: int, args: dict = None) -> None:
+        """
+        Ignores the span.
+        """
+        pass
+
+
+if __name__ == "__main__":
+    from UserItemData import UserItemData
+    from ItemBasedPredictor import ItemBasedPredictor
+    from Recommender import Recommender
+
+    tracer = Tracer()
+    uim = UserItemData('data/user_ratedmovies.dat', min_ratings=1000)
+    rec = Recommender(ItemBasedPredictor(), tracer=tracer)
+    rec.fit(uim)
+    for user_id in uim.df["userID"].unique()[:100]:
+        rec.recommend(user_id, n=10)
+    print(tracer.report())
+    tracer.chrome_trace("trace.json")
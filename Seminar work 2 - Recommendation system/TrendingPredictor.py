@@ -0,0 +1,207 @@
+from UserItemData import UserItemData
+from MovieData import MovieData
+from Recommender import Recommender
+from StaticPredictor import StaticPredictor
+from collections import deque
+import pandas as pd
+import numpy as np
+
+
+class TrendingPredictor(StaticPredictor):
+    # The decayed counts are rescaled before their exponents overflow.
+    MAX_EXPONENT = 500.0
+
+    def __init__(self, half_life_days: float = 7, window_days: float = 7, mode: str = "decayed") -> None:
+        """
+        Constructs a new TrendingPredictor object, which predicts values based
+        on the recent number of ratings of the movies. The counts are updated
+        with every new batch of events, so only the new events (and the
+        events leaving the window) are processed.
+
+        :param half_life_days: The age in days after which an event counts half.
+        :param window_days: The length of the sliding window in days.
+        :param mode: "decayed" predicts the exponentially decayed counts,
+                     "window" the number of events in the sliding window.
+        """
+        if mode not in ("decayed", "window"):
+            raise ValueError("unknown mode " + str(mode))
+        self.half_life_days = half_life_days
+        self.window_days = window_days
+        self.mode = mode
+        self.rate = np.log(2) / (half_life_days * 86400)
+        self.window = window_days * 86400
+
+    @staticmethod
+    def _times(events: pd.DataFrame) -> np.ndarray:
+        """
+        Returns the times of the events in seconds, from the timestamp column
+        in milliseconds or from the date columns.
+
+        :param events: The events.
+        :returns: The times.
+        """
+        if "timestamp" in events:
+            return events["timestamp"].to_numpy("float64") / 1000
+        parts = {"year": "date_year", "month": "date_month", "day": "date_day",
+                 "hour": "date_hour", "minute": "date_minute", "second": "date_second"}
+        dates = pd.DataFrame({part: events[column].astype("int64") for part, column in parts.items()
+                              if column in events})
+        return pd.to_datetime(dates).to_numpy("datetime64[s]").astype("float64")
+
+    def fit(self, uim: UserItemData) -> None:
+        """
+        Fits the data to the predictor, the counts start from zero.
+
+        :param uim: The data.
+        """
+        self.movies = pd.Index([], dtype="int64")
+        self.decayed = np.zeros(0)
+        self.window_counts = np.zeros(0, dtype="int64")
+        # The decayed counts are stored relative to the anchor time, so an
+        # update only adds the weights of the new events.
+        self.anchor = None
+        self.clock = -np.inf
+        # The events in the window as batches of times and positions, each
+        # sorted by time and later than the batches before it.
+        self.window_batches = deque()
+        self.update(uim.df)
+
+    def _positions(self, movie_ids: np.ndarray) -> np.ndarray:
+        """
+        Returns the positions of the movies in the counts, new movies are added.
+
+        :param movie_ids: The movie ids.
+        :returns: The positions.
+        """
+        positions = self.movies.get_indexer(movie_ids)
+        new = positions < 0
+        if new.any():
+            self.movies = self.movies.append(pd.Index(pd.unique(movie_ids[new]), dtype="int64"))
+            self.decayed = np.concatenate([self.decayed, np.zeros(len(self.movies) - len(self.decayed))])
+            self.window_counts = np.concatenate([self.window_counts,
+                                                 np.zeros(len(self.movies) - len(self.window_counts), dtype="int64")])
+            positions[new] = self.movies.get_indexer(movie_ids[new])
+        return positions
+
+    def update(self, events: pd.DataFrame, now: float = None) -> None:
+        """
+        Adds new events to the counts. Events older than the window only
+        change the decayed counts.
+
+        :param events: The events with the movieID column and the timestamp
+                       or date columns.
+        :param now: The current time in seconds, the time of the latest event if None.
+        """
+        times = self._times(events)
+        positions = self._positions(events["movieID"].to_numpy())
+        if len(times):
+            if self.anchor is None:
+                self.anchor = times.min()
+            exponents = self.rate * (times - self.anchor)
+            if exponents.max() > self.MAX_EXPONENT:
+                # Moving the anchor to the latest event scales all counts at once.
+                shift = exponents.max()
+                self.decayed *= np.exp(-shift)
+                self.anchor += shift / self.rate
+                exponents -= shift
+            np.add.at(self.decayed, positions, np.exp(exponents))
+
+            order = np.argsort(times, kind="stable")
+            times, positions = times[order], positions[order]
+            late = 0
+            if self.window_batches:
+                late = np.searchsorted(times, self.window_batches[-1][0][-1], side="left")
+                if late:
+                    self._insert_late(times[:late], positions[:late])
+            if late < len(times):
+                self.window_batches.append((times[late:], positions[late:]))
+            np.add.at(self.window_counts, positions, 1)
+            self.clock = max(self.clock, times[-1])
+        self.advance(self.clock if now is None else now)
+
+    def _insert_late(self, times: np.ndarray, positions: np.ndarray) -> None:
+        """
+        Inserts late events into the batches of the window, each into the
+        first batch which ends after it, so only those batches are copied.
+
+        :param times: The sorted times of the late events.
+        :param positions: The positions of the late events.
+        """
+        ends = np.array([batch_times[-1] for batch_times, _ in self.window_batches])
+        batches = np.searchsorted(ends, times, side="left")
+        for batch in np.unique(batches).tolist():
+            late = batches == batch
+            batch_times, batch_positions = self.window_batches[batch]
+            at = np.searchsorted(batch_times, times[late], side="right")
+            self.window_batches[batch] = (np.insert(batch_times, at, times[late]),
+                                          np.insert(batch_positions, at, positions[late]))
+
+    def advance(self, now: float) -> None:
+        """
+        Moves the current time forward, the events which left the window are
+        removed from the window counts. Whole batches are dropped and only
+        the first remaining batch is cut.
+
+        :param now: The current time in seconds.
+        """
+        self.clock = max(self.clock, now)
+        end = self.clock - self.window
+        while self.window_batches:
+            batch_times, batch_positions = self.window_batches[0]
+            expired = np.searchsorted(batch_times, end, side="right")
+            if expired == 0:
+                break
+            np.subtract.at(self.window_counts, batch_positions[:expired], 1)
+            if expired == len(batch_times):
+                self.window_batches.popleft()
+            else:
+                self.window_batches[0] = (batch_times[expired:], batch_positions[expired:])
+                break
+
+    def scores(self) -> np.ndarray:
+        """
+        Returns the current scores of the movies.
+
+        :returns: The scores, in the order of self.movies.
+        """
+        if self.mode == "window":
+            return self.window_counts.astype("float64")
+        if self.anchor is None:
+            return self.decayed.copy()
+        return self.decayed * np.exp(-self.rate * (self.clock - self.anchor))
+
+    def predictions(self) -> tuple[pd.Index, np.ndarray]:
+        """
+        Returns the current scores of all movies.
+
+        :returns: The movie ids and the scores.
+        """
+        return self.movies, self.scores()
+
+    def predict(self, user_id: int) -> dict[int, int | float]:
+        """
+        Predicts the values for data.
+
+        :param user_id: The user id.
+        :returns: The dict of predictions.
+        """
+        return dict(zip(self.movies.tolist(), self.scores().tolist()))
+
+
+if __name__ == "__main__":
+    md = MovieData('data/movies.dat')
+    uim = UserItemData('data/user_ratedmovies.dat', to_date='1.1.2008')
+    tp = TrendingPredictor(half_life_days=30)
+    rec = Recommender(tp)
+    rec.fit(uim)
+    for idmovie, val in rec.recommend(user_id=78, n=5, rec_seen=False):
+        print("Film: {}, ocena: {}".format(md.get_title(idmovie), val))
+
+    # The tags of the following weeks are added as new events, only they are processed.
+    tags = pd.read_table('data/user_taggedmovies-timestamps.dat', encoding_errors="ignore")
+    tags = tags[tags["timestamp"] >= tp.clock * 1000]
+    for start in range(0, min(len(tags), 5000), 1000):
+        tp.update(tags.sort_values("timestamp").iloc[start:start + 1000])
+    tp.mode = "window"
+    for idmovie, val in rec.recommend(user_id=78, n=5, rec_seen=False):
+        print("Film: {}, ocena: {}".format(md.get_title(idmovie), val))
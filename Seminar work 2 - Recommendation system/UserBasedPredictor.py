@@ -0,0 +1,183 @@
+from UserItemData import UserItemData
+from Recommender import Recommender
+from scipy.sparse import csr_matrix
+import pandas as pd
+import numpy as np
+
+
+class UserBasedPredictor:
+    def __init__(self, k: int = 50, min_values: int = 0, threshold: float = 0, similarity: str = "pearson",
+                 memory_mb: int = 256) -> None:
+        """
+        Constructs a new UserBasedPredictor object that predicts ratings based
+        on the ratings of the k most similar users.
+
+        :param k: The number of neighbours of every user.
+        :param min_values: The minimum number of movies rated by both users.
+        :param threshold: The minimum similarity, less similar users are not neighbours.
+        :param similarity: "pearson" centers the ratings by the average of the user,
+                           "adjusted_cosine" by the average of the movie.
+        :param memory_mb: The memory used for one block of users when searching neighbours.
+        """
+        if similarity not in ("pearson", "adjusted_cosine"):
+            raise ValueError("unknown similarity " + str(similarity))
+        self.k = k
+        self.min_values = min_values
+        self.threshold = threshold
+        self.similarity = similarity
+        self.memory_mb = memory_mb
+
+    def fit(self, uim: UserItemData) -> None:
+        """
+        Fits the data to the predictor. The similarities are calculated for
+        blocks of users, and only the k best neighbours of every user are
+        kept, so the memory grows with the number of users times k.
+
+        :param uim: The data.
+        """
+        self.uim = uim
+        users, items, ratings = uim.index()
+        n = len(users)
+
+        rated = ratings.copy()
+        rated.data[:] = 1
+        counts = np.diff(ratings.indptr)
+        self.average_ratings = np.asarray(ratings.sum(axis=1)).ravel() / counts
+
+        # The ratings minus the averages of the users are the deviations
+        # which are predicted.
+        deviations = ratings.copy()
+        deviations.data -= np.repeat(self.average_ratings, counts)
+        if self.similarity == "pearson":
+            centered = deviations
+        else:
+            columns = ratings.tocsc()
+            item_averages = np.asarray(ratings.sum(axis=0)).ravel() / np.maximum(np.diff(columns.indptr), 1)
+            centered = ratings.copy()
+            centered.data -= item_averages[ratings.indices]
+        squared = centered.copy()
+        squared.data **= 2
+
+        size = int(max(1, min(n, self.memory_mb * 1024 ** 2 // (max(n, 1) * 8 * 5))))
+        k = min(self.k, max(n - 1, 0))
+        neighbours = np.zeros((n, k), dtype="int64")
+        weights = np.zeros((n, k))
+        for start in range(0, n, size):
+            end = min(start + size, n)
+            # The sums only run over the movies rated by both users.
+            products = (centered[start:end] @ centered.T).toarray()
+            squares = (squared[start:end] @ rated.T).toarray()
+            squares_t = (rated[start:end] @ squared.T).toarray()
+            common = (rated[start:end] @ rated.T).toarray()
+
+            roots = np.sqrt(squares * squares_t)
+            block = np.divide(products, roots, out=np.zeros_like(products), where=roots != 0)
+            # The user itself and the users who are not similar enough can
+            # not be selected as neighbours.
+            block[(common == 0) | (common < self.min_values) | (block < self.threshold)] = -np.inf
+            block[np.arange(end - start), np.arange(start, end)] = -np.inf
+
+            if k > 0:
+                best = np.argpartition(-block, k - 1, axis=1)[:, :k]
+                neighbours[start:end] = best
+                best_weights = np.take_along_axis(block, best, axis=1)
+                weights[start:end] = np.where(np.isfinite(best_weights), best_weights, 0.0)
+
+        self.neighbours = csr_matrix((weights.ravel(), neighbours.ravel(), np.arange(n + 1) * k),
+                                     shape=(n, n))
+        self.neighbours.eliminate_zeros()
+        self.neighbours.sort_indices()
+
+        self.users = pd.Index(users)
+        self.items = pd.Index(items)
+        self.deviations = deviations
+        self.rated = rated
+        self.deviations_columns = deviations.tocsc()
+        self.rated_columns = rated.tocsc()
+        # Predictions are returned in the order in which the movies appear in the data.
+        self.order = np.searchsorted(items, pd.unique(uim.df["movieID"]))
+
+    def _predict_rows(self, rows: np.ndarray) -> np.ndarray:
+        """
+        Predicts the values of the users in the rows, the average of the user
+        plus the weighted average of the deviations of the neighbours who
+        rated the movie, or the average of the user if no neighbour did.
+
+        :param rows: The rows of the users.
+        :returns: The matrix of predictions, one row per user.
+        """
+        weights = self.neighbours[rows]
+        prediction = (weights @ self.deviations).toarray()
+        weights = abs(weights)
+        divisor = (weights @ self.rated).toarray()
+
+        average = self.average_ratings[rows].reshape(-1, 1)
+        return average + np.divide(prediction, divisor, out=np.zeros_like(prediction), where=divisor != 0)
+
+    def predict(self, user_id: int) -> dict[int, int | float]:
+        """
+        Predicts the values for data.
+
+        :param user_id: The user id.
+        :returns: The dict of predictions.
+        """
+        prediction = self._predict_rows(np.array([self.users.get_loc(user_id)]))[0]
+        return dict(zip(self.items[self.order].tolist(), prediction[self.order].tolist()))
+
+    def predict_items(self, user_id: int, item_ids: np.ndarray) -> np.ndarray:
+        """
+        Predicts the values of the given movies only, which reads just their
+        columns of the deviations.
+
+        :param user_id: The user id.
+        :param item_ids: The movie ids.
+        :returns: The predictions in the order of item_ids, NaN for unknown movies.
+        """
+        row = self.users.get_loc(user_id)
+        positions = self.items.get_indexer(item_ids)
+        known = positions >= 0
+
+        weights = self.neighbours[row]
+        prediction = (weights @ self.deviations_columns[:, positions[known]]).toarray().ravel()
+        divisor = (abs(weights) @ self.rated_columns[:, positions[known]]).toarray().ravel()
+
+        values = np.full(len(positions), np.nan)
+        values[known] = self.average_ratings[row] + np.divide(
+            prediction, divisor, out=np.zeros_like(prediction), where=divisor != 0)
+        return values
+
+    def predict_batch(self, user_ids: list[int]) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Predicts the values for several users at once.
+
+        :param user_ids: The user ids.
+        :returns: The movie ids and the matrix of predictions, one row per user.
+        """
+        rows = self.users.get_indexer(user_ids)
+        if (rows < 0).any():
+            raise KeyError(np.asarray(user_ids)[rows < 0].tolist())
+        return self.items.to_numpy(), self._predict_rows(rows)
+
+    def similar_users(self, user_id: int, n: int) -> list[int, float]:
+        """
+        Finds the n most similar users among the neighbours of the user.
+
+        :param user_id: The user.
+        :param n: How many users should be selected.
+        """
+        row = self.neighbours[self.users.get_loc(user_id)]
+        best = np.argsort(-row.data, kind="stable")[:n]
+        return list(zip(self.users[row.indices[best]].tolist(), row.data[best].tolist()))
+
+
+if __name__ == "__main__":
+    uim = UserItemData('alternative-predictions/data/Preprocessed_data.csv', min_ratings=100,
+                       min_user_ratings=20, schema=UserItemData.BOOKCROSSING)
+    rp = UserBasedPredictor(k=50)
+    rec = Recommender(rp)
+    rec.fit(uim)
+
+    user_id = uim.df["userID"].iloc[0]
+    print("Similar users of {}: {}".format(user_id, rp.similar_users(user_id, 5)))
+    for isbn, val in rec.recommend(user_id, n=10, rec_seen=False):
+        print("Book: {}, ocena: {}".format(uim.decode("movieID", [isbn])[0], val))
@@ -1,8 +1,25 @@
+from scipy.sparse import csr_matrix
 import pandas as pd
+import numpy as np
+import hashlib
 
 
 class UserItemData:
-    def __init__(self, path: str, from_date: str = None, to_date: str = None, min_ratings: int = None) -> None:
+    # The narrowest types which hold the columns of user_ratedmovies.dat.
+    DTYPES = {"userID": "int32", "movieID": "int32", "rating": "float32",
+              "date_day": "int8", "date_month": "int8", "date_year": "int16",
+              "date_hour": "int8", "date_minute": "int8", "date_second": "int8"}
+
+    # The layouts of the data files. Only the listed columns are read and
+    # they are renamed to userID, movieID and rating, so the same predictors
+    # work on every data set. Keys read as categories are replaced by int32
+    # codes when loading.
+    MOVIELENS = {"sep": "\t", "columns": None, "dtype": None}
+    BOOKCROSSING = {"sep": ",", "columns": {"user_id": "userID", "isbn": "movieID", "rating": "rating"},
+                    "dtype": {"user_id": "int32", "isbn": "category", "rating": "float32"}}
+
+    def __init__(self, path: str, from_date: str = None, to_date: str = None, min_ratings: int = None,
+                 min_user_ratings: int = None, schema: dict = None) -> None:
         """
         Constructs a new UserItemData object which contains the dataframe. The 
         dataframe can possibly be filtered based on the passed parameters.
@@ -10,58 +27,303 @@ class UserItemData:
         :param path: Path to the data file.
         :param from_date: The lower limit for date filtering.
         :param to_date: The upper limit for date filtering.
-        :min_ratings: The limit for how many ratings a movie can have.
+        :param min_ratings: The limit for how many ratings a movie can have.
+        :param min_user_ratings: The limit for how many ratings a user can have.
+        :param schema: The layout of the data file, MOVIELENS if None.
         """
         self.path = path
 
-        self.df = pd.read_table(path, encoding_errors="ignore")
+        schema = schema if schema is not None else self.MOVIELENS
+        columns = schema["columns"]
+        self.df = pd.read_csv(path, sep=schema["sep"], encoding_errors="ignore",
+                              usecols=list(columns) if columns is not None else None, dtype=schema["dtype"])
+        if columns is not None:
+            self.df.rename(columns=columns, inplace=True)
+
+        # The original keys of the coded columns, indexed by code.
+        self.keys = dict()
+        for column in ("userID", "movieID"):
+            if isinstance(self.df[column].dtype, pd.CategoricalDtype):
+                self.keys[column] = self.df[column].cat.categories
+                self.df[column] = self.df[column].cat.codes.astype("int32")
+
+        if from_date is not None or to_date is not None:
+            self._limit_dates(from_date, to_date)
+        if min_ratings is not None or min_user_ratings is not None:
+            self._limit_ratings(min_ratings, min_user_ratings)
+
+    @classmethod
+    def from_dataframe(cls, df: pd.DataFrame, path: str = None, keys: dict = None) -> "UserItemData":
+        """
+        Constructs a new UserItemData object from an already loaded dataframe.
+
+        :param df: The dataframe with the ratings.
+        :param path: Path to the data file the dataframe was loaded from.
+        :param keys: The original keys of the coded columns.
+        :returns: The UserItemData object.
+        """
+        uim = cls.__new__(cls)
+        uim.path = path
+        uim.df = df
+        uim.keys = keys if keys is not None else dict()
+        return uim
+
+    def encode(self, column: str, values: list) -> np.ndarray:
+        """
+        Converts the original keys of a column, for example ISBNs, to the codes
+        used in the dataframe.
+
+        :param column: The column, userID or movieID.
+        :param values: The original keys.
+        :returns: The codes, -1 for unknown keys.
+        """
+        if column not in self.keys:
+            return np.asarray(values)
+        return self.keys[column].get_indexer(values)
+
+    def decode(self, column: str, codes: list) -> np.ndarray:
+        """
+        Converts the codes of a column back to the original keys.
+
+        :param column: The column, userID or movieID.
+        :param codes: The codes used in the dataframe.
+        :returns: The original keys.
+        """
+        if column not in self.keys:
+            return np.asarray(codes)
+        return self.keys[column].to_numpy()[np.asarray(codes)]
+
+    @classmethod
+    def read_chunked(cls, path: str, from_date: str = None, to_date: str = None, min_ratings: int = None,
+                     min_user_ratings: int = None, chunksize: int = 1000000) -> "UserItemData":
+        """
+        Constructs a new UserItemData object by streaming the data file in
+        chunks with narrow types. The file is read twice, the first pass
+        counts the ratings of the movies and the second copies the ratings
+        which pass the filters into preallocated arrays, so the memory is
+        bounded by one chunk and the final data. The ratings matrix of
+        index() is built from the same arrays.
+
+        :param path: Path to the data file.
+        :param from_date: The lower limit for date filtering.
+        :param to_date: The upper limit for date filtering.
+        :param min_ratings: The limit for how many ratings a movie can have.
+        :param min_user_ratings: The limit for how many ratings a user can have,
+                                 the users are pruned from the kept ratings.
+        :param chunksize: The number of lines read at once.
+        :returns: The UserItemData object.
+        """
+        def chunks():
+            return pd.read_table(path, encoding_errors="ignore", dtype=cls.DTYPES, chunksize=chunksize)
+
+        def date_mask(chunk):
+            mask = np.ones(len(chunk), dtype=bool)
+            if from_date is None and to_date is None:
+                return mask
+            key = cls._date_key(chunk)
+            if from_date is not None:
+                mask &= key >= cls._date_key(from_date)
+            if to_date is not None:
+                mask &= key < cls._date_key(to_date)
+            return mask
 
+        # The first pass counts the ratings of every movie within the dates.
+        counts = np.zeros(0, dtype="int64")
+        columns = None
+        for chunk in chunks():
+            columns = chunk.dtypes
+            movies = chunk["movieID"].to_numpy()[date_mask(chunk)]
+            chunk_counts = np.bincount(movies)
+            if len(chunk_counts) > len(counts):
+                counts = np.pad(counts, (0, len(chunk_counts) - len(counts)))
+            counts[:len(chunk_counts)] += chunk_counts
+        if columns is None:
+            return cls.from_dataframe(pd.read_table(path, encoding_errors="ignore", dtype=cls.DTYPES), path)
+
+        keep = counts >= (min_ratings if min_ratings is not None else 1)
+        items = np.flatnonzero(keep)
+        # Maps a movie id to its column, or to -1 when the movie is dropped.
+        item_codes = np.full(len(counts), -1, dtype="int32")
+        item_codes[items] = np.arange(len(items), dtype="int32")
+
+        # The second pass copies the kept ratings, the total is known from
+        # the counts, so the arrays are allocated once.
+        total = int(counts[keep].sum())
+        arrays = {name: np.empty(total, dtype=dtype) for name, dtype in columns.items()}
+        cols = np.empty(total, dtype="int32")
+        position = 0
+        for chunk in chunks():
+            movies = chunk["movieID"].to_numpy()
+            mask = date_mask(chunk)
+            mask[mask] = keep[movies[mask]]
+            end = position + int(mask.sum())
+            for name in arrays:
+                arrays[name][position:end] = chunk[name].to_numpy()[mask]
+            cols[position:end] = item_codes[movies[mask]]
+            position = end
+
+        if min_user_ratings is not None:
+            users, rows = np.unique(arrays["userID"], return_inverse=True)
+            mask = cls._k_core(rows, cols, len(users), len(items), min_ratings, min_user_ratings)
+            if not mask.all():
+                arrays = {name: values[mask] for name, values in arrays.items()}
+                kept_items, cols = np.unique(cols[mask], return_inverse=True)
+                items = items[kept_items]
+
+        uim = cls.from_dataframe(pd.DataFrame(arrays, copy=False), path)
+        users, rows = np.unique(arrays["userID"], return_inverse=True)
+        matrix = csr_matrix((arrays["rating"].astype("float64"), (rows, cols)),
+                            shape=(len(users), len(items)))
+        matrix.sort_indices()
+        uim._index = (users, items.astype(arrays["movieID"].dtype), matrix)
+        uim._indexed = uim.df
+        return uim
+
+    @staticmethod
+    def _date_key(dates: pd.DataFrame | str) -> np.ndarray | int:
+        """
+        Converts dates to integers of the form yyyymmdd, which compare in the
+        same order as the dates.
+
+        :param dates: The dataframe with the date columns, or a date in the form dd.mm.yyyy.
+        :returns: The integers of the dates.
+        """
+        if isinstance(dates, str):
+            day, month, year = map(int, dates.split("."))
+            return year * 10000 + month * 100 + day
+        return dates["date_year"].to_numpy("int32") * 10000 + \
+            dates["date_month"].to_numpy("int32") * 100 + dates["date_day"].to_numpy("int32")
+
+    def _limit_dates(self, from_date: str = None, to_date: str = None) -> None:
+        """
+        Filters the dataframe based on the from_date and to_date parameters.
+
+        :param from_date: The lower limit for date filtering.
+        :param to_date: The upper limit for date filtering.
+        """
+        key = self._date_key(self.df)
+        mask = np.ones(len(key), dtype=bool)
         if from_date is not None:
-            self._limit_from_date(from_date)
+            mask &= key >= self._date_key(from_date)
         if to_date is not None:
-            self._limit_to_date(to_date)
+            mask &= key < self._date_key(to_date)
+        self.df = self.df[mask]
+
+    @staticmethod
+    def _k_core(user_codes: np.ndarray, item_codes: np.ndarray, n_users: int, n_items: int,
+                min_ratings: int = None, min_user_ratings: int = None) -> np.ndarray:
+        """
+        Finds the ratings which remain when the movies with fewer than
+        min_ratings ratings and the users with fewer than min_user_ratings
+        ratings are removed repeatedly, until every remaining movie and user
+        has enough ratings.
+
+        :param user_codes: The user of every rating, as an index from 0 to n_users.
+        :param item_codes: The movie of every rating, as an index from 0 to n_items.
+        :param n_users: The number of users.
+        :param n_items: The number of movies.
+        :param min_ratings: The limit for how many ratings a movie can have.
+        :param min_user_ratings: The limit for how many ratings a user can have.
+        :returns: The mask of the kept ratings.
+        """
+        min_ratings = min_ratings or 0
+        min_user_ratings = min_user_ratings or 0
+        kept = np.arange(len(user_codes))
+        while True:
+            users = user_codes[kept]
+            items = item_codes[kept]
+            drop = (np.bincount(items, minlength=n_items) < min_ratings)[items]
+            drop |= (np.bincount(users, minlength=n_users) < min_user_ratings)[users]
+            if not drop.any():
+                break
+            kept = kept[~drop]
+        mask = np.zeros(len(user_codes), dtype=bool)
+        mask[kept] = True
+        return mask
+
+    def _limit_ratings(self, min_ratings: int = None, min_user_ratings: int = None) -> None:
+        """
+        Filters the dataframe based on the min_ratings and min_user_ratings
+        parameters, see _k_core.
+
+        :param min_ratings: The limit for how many ratings a movie can have.
+        :param min_user_ratings: The limit for how many ratings a user can have.
+        """
+        user_codes, users = pd.factorize(self.df["userID"])
+        item_codes, items = pd.factorize(self.df["movieID"])
+        self.df = self.df[self._k_core(user_codes, item_codes, len(users), len(items),
+                                       min_ratings, min_user_ratings)]
+
+    def _subset(self, mask: np.ndarray, min_ratings: int = None) -> "UserItemData":
+        """
+        Returns the ratings selected by the mask as a new UserItemData object,
+        optionally filtered based on the min_ratings parameter.
+
+        :param mask: The mask or the positions of the selected ratings.
+        :param min_ratings: The limit for how many ratings a movie can have.
+        :returns: The UserItemData object.
+        """
+        uim = UserItemData.from_dataframe(self.df.iloc[mask], self.path, self.keys)
         if min_ratings is not None:
-            self._limit_ratings(min_ratings)
+            uim._limit_ratings(min_ratings)
+        return uim
 
-    def _limit_from_date(self, from_date: str) -> None:
+    def split_temporal(self, to_date: str, from_date: str = None, train_min_ratings: int = None,
+                       test_min_ratings: int = None) -> tuple["UserItemData", "UserItemData"]:
         """
-        Filters the dataframe based on the from_date parameter.
+        Splits the ratings by date, the ratings before to_date are used for
+        training and the ratings from from_date on for testing.
 
-        :param from_date: The lower limit for date filtering.
+        :param to_date: The upper limit of the training dates.
+        :param from_date: The lower limit of the test dates, to_date if None.
+        :param train_min_ratings: The limit for how many training ratings a movie can have.
+        :param test_min_ratings: The limit for how many test ratings a movie can have.
+        :returns: The training and the test data.
         """
-        format_data = "%d.%m.%Y"
-        self.df.rename(columns={"date_year": "year",
-                       "date_month": "month", "date_day": "day"}, inplace=True)
-        self.df["date"] = pd.to_datetime(
-            self.df[["day", "month", "year"]])
-        self.df = self.df[self.df["date"] >=
-                          pd.to_datetime(from_date, format=format_data)]
-        self.df.drop("date", axis=1)
+        key = self._date_key(self.df)
+        from_date = to_date if from_date is None else from_date
+        return self._subset(key < self._date_key(to_date), train_min_ratings), \
+            self._subset(key >= self._date_key(from_date), test_min_ratings)
 
-    def _limit_to_date(self, to_date: str) -> None:
+    def split_leave_last(self, k: int = 1, train_min_ratings: int = None,
+                         test_min_ratings: int = None) -> tuple["UserItemData", "UserItemData"]:
         """
-        Filters the dataframe based on the to_date parameter.
+        Splits the ratings of every user, the last k ratings of the user
+        are used for testing and the rest for training.
 
-        :param to_date: The upper limit for date filtering.
+        :param k: The number of test ratings of every user.
+        :param train_min_ratings: The limit for how many training ratings a movie can have.
+        :param test_min_ratings: The limit for how many test ratings a movie can have.
+        :returns: The training and the test data.
         """
-        format_data = "%d.%m.%Y"
-        self.df.rename(columns={"date_year": "year",
-                       "date_month": "month", "date_day": "day"}, inplace=True)
-        self.df["date"] = pd.to_datetime(
-            self.df[["day", "month", "year"]])
-        self.df = self.df[self.df["date"] <
-                          pd.to_datetime(to_date, format=format_data)]
-        self.df.drop("date", axis=1)
+        time = self._date_key(self.df).astype("int64") * 1000000
+        if "date_hour" in self.df.columns:
+            time += self.df["date_hour"].to_numpy("int64") * 10000 + \
+                self.df["date_minute"].to_numpy("int64") * 100 + self.df["date_second"].to_numpy("int64")
+        users = self.df["userID"].to_numpy()
+        order = np.lexsort((time, users))
+        # The position of every rating counted from the last rating of its user.
+        sorted_users = users[order]
+        starts = np.flatnonzero(np.r_[True, sorted_users[1:] != sorted_users[:-1]])
+        ends = np.r_[starts[1:], len(order)]
+        from_end = np.empty(len(order), dtype="int64")
+        from_end[order] = np.repeat(ends, ends - starts) - np.arange(len(order)) - 1
+        test = from_end < k
+        return self._subset(~test, train_min_ratings), self._subset(test, test_min_ratings)
 
-    def _limit_ratings(self, min_ratings: int) -> None:
+    def split_random(self, test_size: float = 0.2, seed: int = 0, train_min_ratings: int = None,
+                     test_min_ratings: int = None) -> tuple["UserItemData", "UserItemData"]:
         """
-        Filters the dataframe based on the min_ratings parameter.
+        Splits the ratings randomly.
 
-        :param to_date: The limit for how many ratings a movie can have.
+        :param test_size: The share of the ratings used for testing.
+        :param seed: The seed of the random generator.
+        :param train_min_ratings: The limit for how many training ratings a movie can have.
+        :param test_min_ratings: The limit for how many test ratings a movie can have.
+        :returns: The training and the test data.
         """
-        counts = self.df["movieID"].value_counts()
-        self.df = self.df[self.df["movieID"].isin(
-            counts[counts >= min_ratings].index)]
+        test = np.random.default_rng(seed).random(len(self.df)) < test_size
+        return self._subset(~test, train_min_ratings), self._subset(test, test_min_ratings)
 
     def read_ratings(self) -> int:
         """
@@ -71,6 +333,36 @@ class UserItemData:
         """
         return self.df.shape[0]
 
+    def fingerprint(self) -> str:
+        """
+        Returns a fingerprint of the ratings, which changes whenever
+        the contents of the dataframe change.
+
+        :returns: The hex digest of the dataframe contents.
+        """
+        hashes = pd.util.hash_pandas_object(self.df, index=False).to_numpy()
+        return hashlib.sha1(hashes.tobytes()).hexdigest()
+
+    def index(self) -> tuple[np.ndarray, np.ndarray, csr_matrix]:
+        """
+        Returns the sorted user ids, the sorted movie ids and the sparse
+        matrix of ratings, where rows are users and columns are movies.
+        The index is built once and rebuilt only when the dataframe is replaced.
+
+        :returns: The user ids, the movie ids and the ratings matrix.
+        """
+        if getattr(self, "_indexed", None) is not self.df:
+            users, user_codes = np.unique(
+                self.df["userID"].to_numpy(), return_inverse=True)
+            items, item_codes = np.unique(
+                self.df["movieID"].to_numpy(), return_inverse=True)
+            matrix = csr_matrix((self.df["rating"].to_numpy(dtype="float64"), (user_codes, item_codes)),
+                                shape=(len(users), len(items)))
+            matrix.sort_indices()
+            self._index = (users, items, matrix)
+            self._indexed = self.df
+        return self._index
+
 
 if __name__ == "__main__":
     uim = UserItemData("data/user_ratedmovies.dat")
@@ -80,7 +372,14 @@ if __name__ == "__main__":
                        from_date="12.1.2007", to_date="16.2.2008", min_ratings=100)
     print(uim.read_ratings())
 
+    uim = UserItemData.read_chunked("data/user_ratedmovies.dat",
+                                    from_date="12.1.2007", to_date="16.2.2008", min_ratings=100)
+    print(uim.read_ratings())
+
+    uim = UserItemData("alternative-predictions/data/Preprocessed_data.csv",
+                       min_ratings=500, schema=UserItemData.BOOKCROSSING)
+    print(uim.read_ratings(), uim.decode("movieID", uim.df["movieID"].iloc[:3]))
+
 # Results:
-#
-# 855598
-# 73584
+# The earlier results only covered the first two calls, run the script on
+# data/user_ratedmovies.dat to record the output of all of them.